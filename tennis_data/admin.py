@@ -1,42 +1,96 @@
 from django.contrib import admin
+from django.contrib.admin.actions import delete_selected as delete_objects
 from tennis_data.models import (Tournament, Player,
                                 Ranking, Match, Set,
-                                Odds)
+                                Odds, Bookmaker, BookmakerOdds,
+                                QuarantinedRow, Job)
+from tennis_data.cache import bump_data_generation
 
-class TournamentAdmin(admin.ModelAdmin):
+
+class DataAdmin(admin.ModelAdmin):
+    """ Invalidates the cached API responses and the export on every change. """
+
+    actions = ['delete_selected']
+
+    def data_changed(self, objects):
+        """ Called with the saved or deleted objects. """
+
+        bump_data_generation()
+
+    def save_model(self, request, obj, form, change):
+        super(DataAdmin, self).save_model(request, obj, form, change)
+        self.data_changed([obj])
+
+    def delete_model(self, request, obj):
+        super(DataAdmin, self).delete_model(request, obj)
+        self.data_changed([obj])
+
+    def delete_selected(self, request, queryset):
+        objects = list(queryset)
+        response = delete_objects(self, request, queryset)
+        # The confirmation page is returned until the deletion is confirmed
+        if response is None:
+            self.data_changed(objects)
+        return response
+    delete_selected.short_description = delete_objects.short_description
+
+
+class TournamentAdmin(DataAdmin):
     list_display = ('atp_number', 'name',
                     'location', 'series',
                     'court', 'surface',
                     'best_of')
-    list_filter = ('name', 'series',
-                   'court', 'surface',
-                   'best_of')
+    list_filter = ('series', 'court',
+                   'surface', 'best_of')
+    search_fields = ('name', 'location')
 
 
-class RankingAdmin(admin.ModelAdmin):
+class PlayerAdmin(DataAdmin):
+    search_fields = ('name',)
+
+
+class RankingAdmin(DataAdmin):
     list_display = ('player', 'tournament',
                     'rank')
-    list_filter = ('player', 'tournament')
+    list_select_related = True
+    search_fields = ('player__name', 'tournament__name')
+    raw_id_fields = ('player', 'tournament')
 
 
-class MatchAdmin(admin.ModelAdmin):
+class MatchAdmin(DataAdmin):
     list_display = ('winner', 'loser',
                     'tournament', 'date',
                     'round', 'winner_points',
                     'loser_points', 'status',
                     'sets')
-    list_filter = ('tournament', 'status')
+    list_filter = ('status', 'tournament__surface',
+                   'tournament__series')
+    list_select_related = True
+    search_fields = ('winner__name', 'loser__name',
+                     'tournament__name')
+    date_hierarchy = 'date'
+    raw_id_fields = ('winner', 'loser', 'tournament')
+    # Maintained by Match.save
+    exclude = ('pair_low', 'pair_high')
+
+    def queryset(self, request):
+        return super(MatchAdmin, self).queryset(request) \
+                                      .prefetch_related('set_of')
 
     def sets(self, obj):
-        sets = obj.set_of.all()
+        # Sorted here, ordering the prefetched sets would query them again
+        sets = sorted(obj.set_of.all(), key=lambda x: x.set_number)
         return u', '.join(['%s-%s' % (s.winner_games,
                            s.loser_games) for s in sets])
 
 
-class SetAdmin(admin.ModelAdmin):
+class SetAdmin(DataAdmin):
     list_display = ('winner', 'loser',
                     'set_number', 'winner_games',
                     'loser_games')
+    list_select_related = True
+    search_fields = ('match__winner__name', 'match__loser__name')
+    raw_id_fields = ('match',)
 
     def winner(self, obj):
         return obj.match.winner
@@ -45,9 +99,14 @@ class SetAdmin(admin.ModelAdmin):
         return obj.match.loser
 
 
-class OddsAdmin(admin.ModelAdmin):
-    exclude = ('max_winner', 'max_loser',
-               'avg_winner', 'avg_loser')
+class OddsAdmin(DataAdmin):
+    readonly_fields = ('b365_winner', 'b365_loser',
+                       'ex_winner', 'ex_loser',
+                       'lb_winner', 'lb_loser',
+                       'ps_winner', 'ps_loser',
+                       'sj_winner', 'sj_loser',
+                       'max_winner', 'max_loser',
+                       'avg_winner', 'avg_loser')
     list_display = ('match',
                     'b365_winner', 'b365_loser',
                     'ex_winner', 'ex_loser',
@@ -56,12 +115,46 @@ class OddsAdmin(admin.ModelAdmin):
                     'sj_winner', 'sj_loser',
                     'max_winner', 'max_loser',
                     'avg_winner', 'avg_loser')
+    list_select_related = True
+    search_fields = ('match__winner__name', 'match__loser__name')
+    raw_id_fields = ('match',)
+
+
+class BookmakerOddsAdmin(DataAdmin):
+    list_display = ('match', 'bookmaker',
+                    'winner_odd', 'loser_odd')
+    list_filter = ('bookmaker',)
+    list_select_related = True
+    search_fields = ('match__winner__name', 'match__loser__name')
+    raw_id_fields = ('match',)
+
+    def data_changed(self, objects):
+        Odds.objects.refresh(sorted(set(obj.match_id for obj in objects)))
+        super(BookmakerOddsAdmin, self).data_changed(objects)
+
+
+class QuarantinedRowAdmin(admin.ModelAdmin):
+    list_display = ('run', 'number', 'reason')
+    list_select_related = True
+    search_fields = ('run__source', 'reason')
+    raw_id_fields = ('run',)
+
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'attempts',
+                    'created', 'started', 'finished',
+                    'done', 'total', 'worker')
+    list_filter = ('status', 'kind')
+    raw_id_fields = ('import_run',)
 
 
 admin.site.register(Tournament, TournamentAdmin)
-admin.site.register(Player)
+admin.site.register(Player, PlayerAdmin)
 admin.site.register(Ranking, RankingAdmin)
 admin.site.register(Match, MatchAdmin)
 admin.site.register(Set, SetAdmin)
-admin.site.register(Odds, OddsAdmin)
\ No newline at end of file
+admin.site.register(Odds, OddsAdmin)
+admin.site.register(Bookmaker, DataAdmin)
+admin.site.register(BookmakerOdds, BookmakerOddsAdmin)
+admin.site.register(QuarantinedRow, QuarantinedRowAdmin)
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,110 @@
+import numpy as np
+from tennis_data.models import Odds, BOOKMAKERS, DEFAULT_ODD
+
+# The odds sources of the backtests, the aggregates besides the bookmakers
+SOURCES = BOOKMAKERS + ('max', 'avg')
+
+
+def load_odds(filters):
+    """ Loads the odds of the matches matching the filters into arrays.
+
+    The filters are lookups on the match, e.g. {'date__gte': date}. Returns
+    the winner and loser odds as (matches x sources) arrays in the column
+    order of SOURCES, the missing odds are NaN. The matches are sorted by
+    date.
+    """
+
+    columns = []
+    for source in SOURCES:
+        columns.extend([source + '_winner', source + '_loser'])
+    match_filters = dict(('match__' + lookup, value)
+                         for lookup, value in filters.iteritems())
+    odds_data = Odds.objects.filter(**match_filters) \
+                            .order_by('match__date', 'match') \
+                            .values_list(*columns)
+    odds = np.array(list(odds_data), dtype=np.float64).reshape(-1, len(columns))
+    odds[odds <= DEFAULT_ODD] = np.nan
+    return odds[:, 0::2], odds[:, 1::2]
+
+
+def bookmaker_margins(winner_odds, loser_odds):
+    """ The implied probabilities, the overround and the fair odds by source. """
+
+    winner_implied = 1.0 / winner_odds
+    loser_implied = 1.0 / loser_odds
+    booksum = winner_implied + loser_implied
+    fair_winner = winner_implied / booksum
+    ret = {}
+    with np.errstate(invalid='ignore'):
+        for i, source in enumerate(SOURCES):
+            covered = ~np.isnan(booksum[:, i])
+            count = int(covered.sum())
+            if not count:
+                ret[source] = {'matches': 0}
+                continue
+            ret[source] = {
+                'matches': count,
+                'overround': float(booksum[covered, i].mean() - 1.0),
+                'winner_implied_probability': float(winner_implied[covered, i].mean()),
+                'winner_fair_probability': float(fair_winner[covered, i].mean()),
+                'winner_fair_odds': float((1.0 / fair_winner[covered, i]).mean()),
+                'favourite_win_rate': float(
+                    (winner_odds[covered, i] < loser_odds[covered, i]).mean())
+            }
+    return ret
+
+
+def summarize(stakes, profits):
+    """ The result of a strategy betting stakes and making profits in order. """
+
+    bets = int(stakes.sum())
+    if not bets:
+        return {'bets': 0}
+    cumulative = np.cumsum(profits)
+    peaks = np.maximum.accumulate(np.concatenate([[0.0], cumulative]))[1:]
+    return {
+        'bets': bets,
+        'profit': float(cumulative[-1]),
+        'roi': float(cumulative[-1] / stakes.sum()),
+        'max_drawdown': float((peaks - cumulative).max())
+    }
+
+
+def backtest(winner_odds, loser_odds, threshold):
+    """ Backtests the strategies betting one unit on every match.
+
+    favourite backs the player with the lower odds, threshold backs every
+    player whose odds are at least the threshold.
+    """
+
+    with np.errstate(invalid='ignore'):
+        favourite_stakes = (~np.isnan(winner_odds) & ~np.isnan(loser_odds) &
+                            (winner_odds != loser_odds)).astype(np.float64)
+        favourite_profits = np.where(winner_odds < loser_odds,
+                                     winner_odds - 1.0, -1.0) * favourite_stakes
+        winner_backed = winner_odds >= threshold
+        loser_backed = loser_odds >= threshold
+    threshold_stakes = winner_backed.astype(np.float64) + loser_backed
+    threshold_profits = np.where(winner_backed, winner_odds - 1.0, 0.0) \
+        - loser_backed
+    ret = {}
+    for i, source in enumerate(SOURCES):
+        ret[source] = {
+            'favourite': summarize(favourite_stakes[:, i],
+                                   favourite_profits[:, i]),
+            'threshold': summarize(threshold_stakes[:, i],
+                                   threshold_profits[:, i])
+        }
+    return ret
+
+
+def analyze(filters, threshold):
+    """ The margins and the backtest results of the filtered matches by odds source. """
+
+    winner_odds, loser_odds = load_odds(filters)
+    return {
+        'matches': len(winner_odds),
+        'threshold': threshold,
+        'margins': bookmaker_margins(winner_odds, loser_odds),
+        'backtests': backtest(winner_odds, loser_odds, threshold)
+    }
@@ -1,10 +1,33 @@
-from django.http import HttpResponse
-from json import dumps
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.http.response import HttpResponseBase
+from django.core.servers.basehttp import FileWrapper
+from django.db.models import Q, Min
+from django.utils.cache import patch_cache_control
+from django.utils.http import (http_date, parse_http_date_safe,
+                               parse_etags, quote_etag)
+from json import dumps, loads
 from tennis_data.models import (Tournament, Player,
                                 Ranking, Match, Set,
-                                Odds)
+                                Odds, BookmakerOdds,
+                                PlayerStats, PlayerRating, ImportRun, Job)
+from tennis_data.stats import COUNTERS
+from tennis_data import analytics
+from tennis_data.export import iterate_by_id, open_export, ODDS_COLUMNS
+from tennis_data.settings import (API_PAGE_SIZE, API_MAX_PAGE_SIZE,
+                                  API_MAX_BATCH_SIZE,
+                                  API_EXPORT_CHUNK_SIZE,
+                                  API_EXPORT_RETRY_AFTER,
+                                  API_LIST_CACHE_TIMEOUT,
+                                  API_DETAIL_CACHE_TIMEOUT,
+                                  API_CLIENT_MAX_AGE)
+from tennis_data.cache import api_cache, data_generation
+from tennis_data.jobs import enqueue_once
+import datetime
+import os
 from functools import wraps
-from itertools import izip
+from hashlib import md5
+from collections import OrderedDict
 
 
 class APIError(Exception):
@@ -15,15 +38,93 @@ class IDError(APIError):
     msg = "We couldn't find any object with the given id!"
 
 
+class ParameterError(APIError):
+    def __init__(self, msg):
+        super(ParameterError, self).__init__(msg)
+        self.msg = msg
+
+
+class Page(list):
+    """ A page of results along with the cursor of the next page. """
+
+    def __init__(self, items, next_cursor):
+        super(Page, self).__init__(items)
+        self.next_cursor = next_cursor
+
+
 def jsonify(function):
+    """ Encodes the result of the view and answers conditional GET requests.
+
+    The data only changes with the imports, so the ETag and Last-Modified
+    headers of the successful responses are derived from the data
+    generation and the url. A request revalidating the current generation
+    gets a 304 without running the view.
+    """
+
+    @wraps(function)
+    def wrapper(request, *args, **kwargs):
+        if request.method == 'GET':
+            generation = data_generation()
+            etag = '%s-%s' % (generation,
+                              md5(request.get_full_path()).hexdigest())
+            last_modified = generation // 1000
+            if not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+                set_validators(response, etag, last_modified)
+                return response
+        response = encode(function(request, *args, **kwargs))
+        if request.method == 'GET' and response.status_code == 200:
+            set_validators(response, etag, last_modified)
+        return response
+    return wrapper
+
+
+def jsonify_uncached(function):
+    """ Encodes the result of a view whose data doesn't follow the imports.
+
+    The clients have to fetch it again on every request.
+    """
+
     @wraps(function)
-    def wrapper(*args, **kwargs):
-        dictionary = function(*args, **kwargs)
-        return HttpResponse(dumps(dictionary),
-                            mimetype='application/json')
+    def wrapper(request, *args, **kwargs):
+        response = encode(function(request, *args, **kwargs))
+        patch_cache_control(response, no_cache=True)
+        return response
     return wrapper
 
 
+def encode(dictionary):
+    """ The response of the result of a view. """
+
+    if isinstance(dictionary, HttpResponseBase):
+        return dictionary
+    if isinstance(dictionary, basestring):
+        # Already encoded, e.g. by cached
+        return HttpResponse(dictionary, mimetype='application/json')
+    return HttpResponse(dumps(dictionary), mimetype='application/json')
+
+
+def not_modified(request, etag, last_modified):
+    """ Whether the client already has the current version of the resource. """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified):
+    """ Sets the headers needed by the clients to revalidate the response. """
+
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, max_age=API_CLIENT_MAX_AGE,
+                        must_revalidate=True)
+
+
 def sanitize(function):
     @wraps(function)
     def wrapper(request, *args, **kwargs):
@@ -40,137 +141,637 @@ def sanitize(function):
                     'status': 'error',
                     'msg': e.msg
                 }
-            return {
+            if isinstance(data, HttpResponseBase):
+                return data
+            ret = {
                 'status': 'ok',
                 'data': data
             }
+            if isinstance(data, Page):
+                ret['next'] = data.next_cursor
+            return ret
     return wrapper
 
 
+def cached(timeout):
+    """ Caches the encoded result of the view for timeout seconds.
+
+    The cache key contains the data generation, so an import invalidates
+    every cached result at once. On a hit neither the view nor the encoder
+    runs. Goes between jsonify and sanitize.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET':
+                return function(request, *args, **kwargs)
+            key = 'api:%s:%s:%s' % (data_generation(), function.__name__,
+                                    md5(request.get_full_path()).hexdigest())
+            cache = api_cache()
+            encoded = cache.get(key)
+            if encoded is None:
+                data = function(request, *args, **kwargs)
+                if isinstance(data, HttpResponseBase):
+                    return data
+                encoded = dumps(data)
+                cache.set(key, encoded, timeout)
+            return encoded
+        return wrapper
+    return decorator
+
+
+def plain_field(column):
+    """ A field serialized as the value of the column. """
+
+    return (column,), lambda row: row[column]
+
+
+def date_field(column):
+    """ A date field serialized in ISO format. """
+
+    return (column,), lambda row: row[column].isoformat()
+
+
+def related_field(column):
+    """ A foreign key serialized as the id and the name of the related object. """
+
+    name_column = column + '__name'
+    return (column, name_column), lambda row: {
+        'id': row[column],
+        'name': row[name_column]
+    }
+
+
+def int_parameter(request, name, default, minimum, maximum=None):
+    """ Validates an integer query parameter. """
+
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ParameterError("The %s parameter has to be an integer!" % name)
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ParameterError("The %s parameter is out of range!" % name)
+    return value
+
+
+def ids_parameter(request, name='ids'):
+    """ Validates a required comma separated list of ids, without duplicates. """
+
+    value = request.GET.get(name)
+    if not value:
+        raise ParameterError("The %s parameter is required!" % name)
+    try:
+        ids = sorted(set(int(item) for item in value.split(',') if item))
+    except ValueError:
+        raise ParameterError("The %s parameter has to be a list of integers!" % name)
+    if len(ids) > API_MAX_BATCH_SIZE:
+        raise ParameterError("At most %s ids can be requested at once!"
+                             % API_MAX_BATCH_SIZE)
+    return ids
+
+
+def batch(ids, found):
+    """ The batch response of the found objects, an id -> object map.
+
+    The requested ids without an object are listed as missing.
+    """
+
+    return {
+        'found': found,
+        'missing': [current_id for current_id in ids if current_id not in found]
+    }
+
+
+def selected_fields(request, field_specs, default_fields):
+    """ The fields requested by the fields parameter. """
+
+    if 'fields' not in request.GET:
+        return default_fields
+    fields = [field for field in request.GET['fields'].split(',') if field]
+    unknown = [field for field in fields if field not in field_specs]
+    if unknown:
+        raise ParameterError("Unknown fields: %s" % ', '.join(unknown))
+    return fields
+
+
+def field_columns(fields, field_specs):
+    """ The columns needed to serialize the fields, always including the id. """
+
+    columns = set(['id'])
+    for field in fields:
+        columns.update(field_specs[field][0])
+    return columns
+
+
+def float_parameter(request, name, default, minimum):
+    """ Validates a float query parameter. """
+
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise ParameterError("The %s parameter has to be a number!" % name)
+    if value < minimum:
+        raise ParameterError("The %s parameter is out of range!" % name)
+    return value
+
+
+def date_parameter(request, name):
+    """ Validates a YYYY-MM-DD date query parameter, None if it's missing. """
+
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ParameterError("The %s parameter has to be a YYYY-MM-DD date!" % name)
+
+
+def match_filters(request):
+    """ Validates the match filtering parameters and returns them as lookups.
+
+    The from and to dates bound the date of the matches, round, surface,
+    series and court are matched exactly, tournament is a tournament id.
+    """
+
+    filters = {}
+    date_from = date_parameter(request, 'from')
+    if date_from is not None:
+        filters['date__gte'] = date_from
+    date_to = date_parameter(request, 'to')
+    if date_to is not None:
+        filters['date__lte'] = date_to
+    for name, lookup in (('round', 'round'),
+                         ('surface', 'tournament__surface'),
+                         ('series', 'tournament__series'),
+                         ('court', 'tournament__court')):
+        if name in request.GET:
+            if not request.GET[name]:
+                raise ParameterError("The %s parameter can't be empty!" % name)
+            filters[lookup] = request.GET[name]
+    if 'tournament' in request.GET:
+        filters['tournament'] = int_parameter(request, 'tournament', None, 0)
+    return filters
+
+
+def paginate(request, queryset, field_specs, default_fields):
+    """ Serializes a page of the queryset ordered by id.
+
+    The page starts after the id given in the after parameter and holds at
+    most limit items. The fields parameter selects the serialized fields,
+    only their columns are fetched.
+    """
+
+    fields = selected_fields(request, field_specs, default_fields)
+    after = int_parameter(request, 'after', None, 0)
+    limit = int_parameter(request, 'limit', API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+
+    columns = field_columns(fields, field_specs)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset.order_by('id').values(*columns)[:limit + 1])
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return Page([
+        dict((field, field_specs[field][1](row)) for field in fields)
+        for row in rows[:limit]
+    ], next_cursor)
+
+
+def serialize_match(match):
+    """ Serializes a match with its tournament and prefetched sets. """
+
+    current_sets = sorted(match.set_of.all(), key=lambda x: x.set_number)
+    return {
+        'id': match.pk,
+        'tournament': {
+            'id': match.tournament.id,
+            'name': match.tournament.name
+        },
+        'date': match.date.isoformat(),
+        'round': match.round,
+        'winner_points': match.winner_points,
+        'loser_points': match.loser_points,
+        'status': match.status,
+        'sets': [[s.winner_games, s.loser_games] for s in current_sets]
+    }
+
+
+def serialize_odds(odds, bookmaker_odds):
+    """ Serializes the odds of a match with its (bookmaker, winner odd,
+    loser odd) rows.
+    """
+
+    ret = dict((column, getattr(odds, column)) for column in ODDS_COLUMNS)
+    ret['bookmakers'] = dict(
+        (name, {'winner': winner_odd, 'loser': loser_odd})
+        for name, winner_odd, loser_odd in bookmaker_odds
+    )
+    return ret
+
+
+PLAYER_FIELDS = {
+    'id': plain_field('id'),
+    'name': plain_field('name')
+}
+
+
 @jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
 @sanitize
 def players(request):
-    player_data = Player.objects.all()
-    return [
-        {
-            "id": player.pk,
-            "name": player.name
-        }
-        for player in player_data
-    ]
+    return paginate(request, Player.objects.all(),
+                    PLAYER_FIELDS, ('id', 'name'))
 
 
 @jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
 @sanitize
 def player_matches(request, player_id):
     try:
         player = Player.objects.get(pk=player_id)
     except Player.DoesNotExist:
         raise IDError
-    won_matches = player.winner_of.all()
-    lost_matches = player.loser_of.all()
-    ret = {}
-    match_pairs = (('won', won_matches), ('lost', lost_matches))
-    for match_type, matches in match_pairs:
-        ret[match_type] = []
-        for match in matches:
-            current_match = {
-                'id': match.pk,
-                'tournament': {
-                    'id': match.tournament.id,
-                    'name': match.tournament.name
-                },
-                'date': match.date.isoformat(),
-                'round': match.round,
-                'winner_points': match.winner_points,
-                'loser_points': match.loser_points,
-                'status': match.status
-            }
-            current_sets = sorted(match.set_of.all(), key=lambda x: x.set_number)
-            current_match['sets'] = [[s.winner_games, s.loser_games]
-                                     for s in current_sets]
-            ret[match_type].append(current_match)
+    player_match_data = Match.objects.filter(Q(winner=player) | Q(loser=player)) \
+                                     .select_related('tournament') \
+                                     .prefetch_related('set_of')
+    ret = {'won': [], 'lost': []}
+    for match in player_match_data:
+        match_type = 'won' if match.winner_id == player.pk else 'lost'
+        ret[match_type].append(serialize_match(match))
     return ret
 
 
 @jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
 @sanitize
-def tournaments(request):
-    tournament_data = Tournament.objects.all()
+def head_to_head(request, player_a, player_b):
+    """ The matches of two players against each other with a summary. """
+
+    player_a, player_b = int(player_a), int(player_b)
+    if player_a == player_b:
+        raise ParameterError("The two players have to be different!")
+    names = dict(Player.objects.filter(pk__in=[player_a, player_b])
+                               .values_list('id', 'name'))
+    if player_a not in names or player_b not in names:
+        raise IDError
+    pair_low, pair_high = Match.pair(player_a, player_b)
+    h2h_match_data = Match.objects.filter(pair_low=pair_low, pair_high=pair_high) \
+                                  .order_by('date', 'id') \
+                                  .select_related('tournament') \
+                                  .prefetch_related('set_of')
+    summary = dict((player_id, {'id': player_id, 'name': names[player_id],
+                                'wins': 0, 'sets': 0, 'games': 0})
+                   for player_id in (player_a, player_b))
+    ret = []
+    for match in h2h_match_data:
+        current_match = serialize_match(match)
+        current_match['winner'] = match.winner_id
+        winner = summary[match.winner_id]
+        loser = summary[match.loser_id]
+        winner['wins'] += 1
+        for winner_games, loser_games in current_match['sets']:
+            set_winner = winner if winner_games > loser_games else loser
+            set_winner['sets'] += 1
+            winner['games'] += winner_games
+            loser['games'] += loser_games
+        ret.append(current_match)
+    return {
+        'players': [summary[player_a], summary[player_b]],
+        'matches': ret
+    }
+
+
+TOURNAMENT_FIELDS = {
+    'id': plain_field('id'),
+    'atp_number': plain_field('atp_number'),
+    'name': plain_field('name'),
+    'location': plain_field('location'),
+    'series': plain_field('series'),
+    'court': plain_field('court'),
+    'surface': plain_field('surface'),
+    'best_of': plain_field('best_of')
+}
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
+@sanitize
+def player_stats(request, player_id):
+    """ The statistics of the player by season and surface.
+
+    The season and surface parameters filter the rows.
+    """
+
+    filters = {'player': player_id}
+    if 'season' in request.GET:
+        filters['season'] = int_parameter(request, 'season', None, 0)
+    if 'surface' in request.GET:
+        filters['surface'] = request.GET['surface']
+    stats_data = PlayerStats.objects.filter(**filters) \
+                                    .order_by('season', 'surface') \
+                                    .values('season', 'surface', *COUNTERS)
+    ret = list(stats_data)
+    if not ret and not Player.objects.filter(pk=player_id).exists():
+        raise IDError
+    return ret
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
+@sanitize
+def player_rating(request, player_id):
+    """ The current overall and per surface Elo ratings of the player. """
+
+    rating_data = PlayerRating.objects.filter(player=player_id) \
+                                      .values_list('surface', 'rating', 'matches')
+    ret = {'overall': None, 'surfaces': {}}
+    for surface, rating, matches in rating_data:
+        current_rating = {'rating': rating, 'matches': matches}
+        if surface:
+            ret['surfaces'][surface] = current_rating
+        else:
+            ret['overall'] = current_rating
+    if ret['overall'] is None and not Player.objects.filter(pk=player_id).exists():
+        raise IDError
+    return ret
+
+
+@jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
+@sanitize
+def ratings(request):
+    """ The players ordered by their Elo rating.
+
+    The surface parameter selects a surface rating instead of the overall
+    one, limit is the number of players returned.
+    """
+
+    limit = int_parameter(request, 'limit', API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+    rating_data = PlayerRating.objects.filter(surface=request.GET.get('surface', '')) \
+                                      .order_by('-rating') \
+                                      .values_list('player', 'player__name',
+                                                   'rating', 'matches')[:limit]
     return [
         {
-            "id": tournament.pk,
-            "name": tournament.name
+            'id': player_id,
+            'name': name,
+            'rating': rating,
+            'matches': matches
         }
-        for tournament in tournament_data
+        for player_id, name, rating, matches in rating_data
     ]
 
 
 @jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
+@sanitize
+def tournaments(request):
+    return paginate(request, Tournament.objects.all(),
+                    TOURNAMENT_FIELDS, ('id', 'name'))
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
 @sanitize
 def tournament_players(request, tournament_id):
-    try:
-        tournament = Tournament.objects.get(pk=tournament_id)
-    except Tournament.DoesNotExist, e:
-        raise IDError
-    tournament_matches = tournament.match_of.all()
-    tournament_players = set()
-    for tournament_match in tournament_matches:
-        tournament_players.add(tournament_match.winner)
-        tournament_players.add(tournament_match.loser)
-    rankings = []
-    for tplayer in tournament_players:
-        rankings.append(Ranking.objects.get(tournament=tournament,
-                                            player=tplayer))
-    return sorted([
+    # The importer creates a ranking for both players of every match, so
+    # the rankings of the tournament are exactly its players.
+    player_data = Ranking.objects.filter(tournament=tournament_id) \
+                                 .values('player', 'player__name') \
+                                 .annotate(rank=Min('rank')) \
+                                 .order_by('rank', 'player__name')
+    ret = [
         {
-            'id': tplayer.id,
-            'name': tplayer.name,
-            'rank': ranking.rank
+            'id': tplayer['player'],
+            'name': tplayer['player__name'],
+            'rank': tplayer['rank']
         }
-        for ranking, tplayer in izip(rankings, tournament_players)
-    ], key=lambda x: x['rank'])
+        for tplayer in player_data
+    ]
+    if not ret and not Tournament.objects.filter(pk=tournament_id).exists():
+        raise IDError
+    return ret
+
+
+MATCH_FIELDS = {
+    'id': plain_field('id'),
+    'tournament': related_field('tournament'),
+    'winner': related_field('winner'),
+    'loser': related_field('loser'),
+    'date': date_field('date'),
+    'round': plain_field('round'),
+    'winner_points': plain_field('winner_points'),
+    'loser_points': plain_field('loser_points'),
+    'status': plain_field('status')
+}
 
 
 @jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
 @sanitize
 def matches(request):
-    match_data = Match.objects.all()
-    return [
-        {
-            'id': match.id,
-            'tournament': {
-                'id': match.tournament.id,
-                'name': match.tournament.name
-            },
-            'round': match.round,
-            'date': match.date.isoformat()
-        }
-        for match in match_data
-    ]
+    return paginate(request, Match.objects.all(), MATCH_FIELDS,
+                    ('id', 'tournament', 'round', 'date'))
 
 
 @jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
+@sanitize
+def search_matches(request):
+    """ A page of the matches filtered like in match_filters.
+
+    The player parameter selects the matches of a player. Paginated and
+    serialized like matches.
+    """
+
+    match_data = Match.objects.filter(**match_filters(request))
+    if 'player' in request.GET:
+        player_id = int_parameter(request, 'player', None, 0)
+        match_data = match_data.filter(Q(winner=player_id) | Q(loser=player_id))
+    return paginate(request, match_data, MATCH_FIELDS,
+                    ('id', 'tournament', 'round', 'date'))
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
 @sanitize
 def match_odds(request, match_id):
     try:
         match = Match.objects.get(pk=match_id)
     except Match.DoesNotExist, e:
         raise IDError
-    match_odds = match.odds_of.get()
+    bookmaker_odds = match.bookmaker_odds_of.values_list('bookmaker__name',
+                                                         'winner_odd',
+                                                         'loser_odd')
+    return serialize_odds(match.odds_of.get(), bookmaker_odds)
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
+@sanitize
+def batch_odds(request):
+    """ The odds of the matches given in the ids parameter.
+
+    Two queries whatever the number of ids, see batch for the format.
+    """
+
+    ids = ids_parameter(request)
+    bookmaker_odds = dict((current_id, []) for current_id in ids)
+    bookmaker_odds_data = BookmakerOdds.objects.filter(match__in=ids) \
+                                               .values_list('match',
+                                                            'bookmaker__name',
+                                                            'winner_odd',
+                                                            'loser_odd')
+    for row in bookmaker_odds_data:
+        bookmaker_odds[row[0]].append(row[1:])
+    return batch(ids, dict(
+        (odds.match_id, serialize_odds(odds, bookmaker_odds[odds.match_id]))
+        for odds in Odds.objects.filter(match__in=ids)
+    ))
+
+
+@jsonify
+@cached(API_DETAIL_CACHE_TIMEOUT)
+@sanitize
+def match_details(request):
+    """ The matches given in the ids parameter with their players and sets.
+
+    Two queries whatever the number of ids, see batch for the format.
+    """
+
+    ids = ids_parameter(request)
+    match_data = Match.objects.filter(pk__in=ids) \
+                              .select_related('tournament', 'winner', 'loser') \
+                              .prefetch_related('set_of')
+    found = {}
+    for match in match_data:
+        current_match = serialize_match(match)
+        for side in ('winner', 'loser'):
+            player = getattr(match, side)
+            current_match[side] = {'id': player.id, 'name': player.name}
+        found[match.pk] = current_match
+    return batch(ids, found)
+
+
+@jsonify
+@sanitize
+def export_matches(request):
+    """ Streams every match as newline delimited JSON. """
+
+    fields = selected_fields(request, MATCH_FIELDS, sorted(MATCH_FIELDS))
+    rows = iterate_by_id(Match.objects.all(),
+                         field_columns(fields, MATCH_FIELDS),
+                         API_EXPORT_CHUNK_SIZE)
+    lines = (dumps(dict((field, MATCH_FIELDS[field][1](row))
+                        for field in fields)) + '\n'
+             for row in rows)
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+@jsonify
+@sanitize
+def export_matches_npz(request):
+    """ The denormalized match table as a compressed NumPy npz file.
+
+    The file of a data generation is built by an export job queued by the
+    jobs changing the data. Until it's built the response is a 503, which
+    queues the job if the data was changed elsewhere (e.g. in the admin).
+    """
+
+    export_file = open_export()
+    if export_file is None:
+        enqueue_once('export')
+        response = HttpResponse(dumps({
+            'status': 'error',
+            'msg': "The export is being built, try again later!"
+        }), mimetype='application/json', status=503)
+        response['Retry-After'] = API_EXPORT_RETRY_AFTER
+        patch_cache_control(response, no_cache=True)
+        return response
+    response = StreamingHttpResponse(FileWrapper(export_file),
+                                     content_type='application/octet-stream')
+    response['Content-Length'] = os.fstat(export_file.fileno()).st_size
+    response['Content-Disposition'] = 'attachment; filename=matches.npz'
+    return response
+
+
+@jsonify
+@cached(API_LIST_CACHE_TIMEOUT)
+@sanitize
+def odds_analysis(request):
+    """ The bookmaker margins and strategy backtests of the filtered matches.
+
+    The matches are filtered like in match_filters, threshold is the minimal
+    odds backed by the threshold strategy.
+    """
+
+    filters = match_filters(request)
+    return analytics.analyze(filters,
+                             float_parameter(request, 'threshold', 3.0, 1.0))
+
+
+IMPORT_RUN_FIELDS = {
+    'id': plain_field('id'),
+    'source': plain_field('source'),
+    'layout': plain_field('layout'),
+    'started': date_field('started'),
+    'finished': date_field('finished'),
+    'status': plain_field('status'),
+    'rows': plain_field('rows'),
+    'rejected': plain_field('rejected'),
+    'imported': plain_field('imported'),
+    'seconds': plain_field('seconds'),
+    'rows_per_second': (('imported', 'seconds'),
+                        lambda row: row['imported'] / max(row['seconds'], 1e-6)),
+    'queries': plain_field('queries'),
+    'stages': (('stages',),
+               lambda row: loads(row['stages'], object_pairs_hook=OrderedDict)),
+    'error': plain_field('error')
+}
+
+
+@jsonify_uncached
+@sanitize
+def imports(request):
+    """ The stored import runs with their per stage timings.
+
+    Not cached, the runs without new data don't start a new generation.
+    """
+
+    return paginate(request, ImportRun.objects.all(), IMPORT_RUN_FIELDS,
+                    sorted(IMPORT_RUN_FIELDS))
+
+
+@jsonify_uncached
+@sanitize
+def job(request, job_id):
+    """ The status and the progress of a job. """
+
+    try:
+        current_job = Job.objects.get(pk=job_id)
+    except Job.DoesNotExist:
+        raise IDError
     return {
-        'b365_winner': match_odds.b365_winner,
-        'b365_loser': match_odds.b365_loser,
-        'ex_winner': match_odds.ex_winner,
-        'ex_loser': match_odds.ex_loser,
-        'lb_winner': match_odds.lb_winner,
-        'lb_loser': match_odds.lb_loser,
-        'ps_winner': match_odds.ps_winner,
-        'ps_loser': match_odds.ps_loser,
-        'sj_winner': match_odds.sj_winner,
-        'sj_loser': match_odds.sj_loser,
-        'max_winner': match_odds.max_winner,
-        'max_loser': match_odds.max_loser,
-        'avg_winner': match_odds.avg_winner,
-        'avg_loser': match_odds.avg_loser,
+        'id': current_job.pk,
+        'kind': current_job.kind,
+        'arguments': loads(current_job.arguments),
+        'status': current_job.status,
+        'attempts': current_job.attempts,
+        'max_attempts': current_job.max_attempts,
+        'created': current_job.created.isoformat(),
+        'run_after': current_job.run_after.isoformat(),
+        'started': current_job.started and current_job.started.isoformat(),
+        'finished': current_job.finished and current_job.finished.isoformat(),
+        'heartbeat': current_job.heartbeat and current_job.heartbeat.isoformat(),
+        'done': current_job.done,
+        'total': current_job.total,
+        'import_run': current_job.import_run_id,
+        'error': current_job.error
     }
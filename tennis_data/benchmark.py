@@ -0,0 +1,420 @@
+import os
+import re
+import csv
+import time
+import random
+import socket
+import urllib2
+import datetime
+import threading
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from django.db import connection
+from django.test.client import Client
+from tennis_data.models import Tournament, Match
+from tennis_data.middleware import quantile
+from tennis_data.tasks import PopulateDatabase, BulkPopulateDatabase, XLDATE_EPOCH
+from tennis_data.cache import api_cache, bump_data_generation
+from tennis_data import ratings, export
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+# The header row of the synthetic seasons, the 2011 ATP layout
+HEADERS = ('ATP', 'Location', 'Tournament', 'Date', 'Series', 'Court',
+           'Surface', 'Round', 'Best of', 'Winner', 'Loser', 'WRank', 'LRank',
+           'WPts', 'LPts', 'W1', 'L1', 'W2', 'L2', 'W3', 'L3', 'W4', 'L4',
+           'W5', 'L5', 'Wsets', 'Lsets', 'Comment', 'B365W', 'B365L', 'EXW',
+           'EXL', 'LBW', 'LBL', 'PSW', 'PSL', 'SJW', 'SJL', 'MaxW', 'MaxL',
+           'AvgW', 'AvgL')
+BOOKMAKER_COUNT = 5
+
+# The size of a real ATP season, scale 1 generates about as many matches
+# and players
+SEASON_MATCHES = 2600
+SEASON_PLAYERS = 400
+
+# Every synthetic tournament is a knockout of DRAW_SIZE players
+DRAW_SIZE = 32
+ROUNDS = ('1st Round', '2nd Round', 'Quarterfinals', 'Semifinals', 'The Final')
+SURFACES = ('Hard', 'Clay', 'Grass', 'Carpet')
+COURTS = ('Outdoor', 'Indoor')
+SERIES = ('ATP250', 'ATP250', 'ATP500', 'Masters 1000', 'Grand Slam')
+
+# The most rows of a sheet of an Excel 97 workbook, besides the header
+XLS_MAX_ROWS = 65535
+
+IMPORTERS = {
+    'bulk': BulkPopulateDatabase,
+    'legacy': PopulateDatabase,
+}
+
+# The metrics compared with the baseline and whether higher is better.
+# The query and error counts are deterministic, any increase is a
+# regression, the timings may vary by the tolerance.
+IMPORT_METRICS = {'seconds': False, 'rows_per_second': True, 'queries': False}
+URL_METRICS = {'throughput': True, 'p50': False, 'p95': False, 'p99': False,
+               'queries': False, 'errors': False}
+EXACT_METRICS = frozenset(('queries', 'errors'))
+
+URL_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+# The query strings of the URLs with required parameters, formatted with
+# the samples
+QUERY_STRINGS = {
+    '/api/matches/search/': 'player={player_id}',
+    '/api/odds/': 'ids={match_ids}',
+    '/api/matches/details/': 'ids={match_ids}',
+}
+# The number of matches requested by the batch URLs
+BATCH_SIZE = 50
+
+
+def set_scores(rng, best_of):
+    """ The (winner games, loser games) pairs of the sets of a match. """
+
+    needed = best_of // 2 + 1
+    won = [(6, rng.randint(0, 4)) if rng.random() < 0.7
+           else rng.choice(((7, 5), (7, 6))) for _ in xrange(needed)]
+    lost = [(rng.randint(0, 4), 6) if rng.random() < 0.7
+            else rng.choice(((5, 7), (6, 7)))
+            for _ in xrange(rng.randint(0, needed - 1))]
+    sets = won[:-1] + lost
+    rng.shuffle(sets)
+    return sets + won[-1:]
+
+
+def match_odds(rng, favourite_won):
+    """ The winner and loser odds of the bookmakers, the maximums and the
+    averages.
+    """
+
+    low = round(rng.uniform(1.05, 1.9), 2)
+    high = round(rng.uniform(1.9, 6.0), 2)
+    winner, loser = (low, high) if favourite_won else (high, low)
+    odds = [(round(winner * rng.uniform(0.95, 1.05), 2),
+             round(loser * rng.uniform(0.95, 1.05), 2))
+            for _ in xrange(BOOKMAKER_COUNT)]
+    columns = [value for pair in odds for value in pair]
+    columns.extend((max(pair[0] for pair in odds), max(pair[1] for pair in odds)))
+    columns.extend((round(sum(pair[0] for pair in odds) / len(odds), 2),
+                    round(sum(pair[1] for pair in odds) / len(odds), 2)))
+    return columns
+
+
+def synthetic_season(scale, year, seed=0):
+    """ Generates the rows of a season scale times the size of a real one.
+
+    The values follow HEADERS, the dates are date objects. The tournaments
+    are spread over the year, the better ranked player wins 65% of the
+    matches. The same seed generates the same season.
+    """
+
+    rng = random.Random(seed)
+    tournaments = max(1, int(round(SEASON_MATCHES * scale / (DRAW_SIZE - 1))))
+    players = max(DRAW_SIZE, int(SEASON_PLAYERS * scale))
+    first_day = datetime.date(year, 1, 1)
+    rows = []
+    for number in xrange(tournaments):
+        series = rng.choice(SERIES)
+        best_of = 5 if series == 'Grand Slam' else 3
+        start = first_day + datetime.timedelta(days=number * 358 // tournaments)
+        tournament = (number + 1, 'City %s' % number, 'Open %s' % number)
+        details = (series, rng.choice(COURTS), rng.choice(SURFACES))
+        draw = rng.sample(xrange(players), DRAW_SIZE)
+        for day, round_name in enumerate(ROUNDS):
+            next_draw = []
+            for a, b in zip(draw[::2], draw[1::2]):
+                favourite, underdog = min(a, b), max(a, b)
+                favourite_won = rng.random() < 0.65
+                winner, loser = ((favourite, underdog) if favourite_won
+                                 else (underdog, favourite))
+                next_draw.append(winner)
+                sets = set_scores(rng, best_of)
+                games = [score for pair in sets for score in pair]
+                games.extend([''] * (10 - len(games)))
+                wsets = sum(1 for w, l in sets if w > l)
+                rows.append(list(tournament) +
+                            [start + datetime.timedelta(days=day)] +
+                            list(details) +
+                            [round_name, best_of,
+                             'Player %s.' % winner, 'Player %s.' % loser,
+                             winner + 1, loser + 1,
+                             10000 // (winner + 1), 10000 // (loser + 1)] +
+                            games + [wsets, len(sets) - wsets, 'Completed'] +
+                            match_odds(rng, favourite_won))
+            draw = next_draw
+    return rows
+
+
+def write_csv(file_name, rows):
+    """ Writes the rows to a CSV file, the dates in the day first format. """
+
+    with open(file_name, 'wb') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(HEADERS)
+        for row in rows:
+            writer.writerow([value.strftime('%d/%m/%Y')
+                             if isinstance(value, datetime.date) else value
+                             for value in row])
+
+
+def write_xls(file_name, sheet_name, rows):
+    """ Writes the rows to a sheet of an Excel workbook, the dates as serial
+    numbers like the real workbooks.
+    """
+
+    if xlwt is None:
+        raise ValueError("Writing Excel workbooks needs the xlwt package")
+    if len(rows) > XLS_MAX_ROWS:
+        raise ValueError("An Excel sheet can't hold %s rows, use CSV"
+                         % len(rows))
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet(sheet_name)
+    for column, header in enumerate(HEADERS):
+        sheet.write(0, column, header)
+    for number, row in enumerate(rows, 1):
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.date):
+                value = float((value - XLDATE_EPOCH).days)
+            sheet.write(number, column, value)
+    workbook.save(file_name)
+
+
+def season_fixture(directory, scale, year, file_format='csv', seed=0):
+    """ Returns the path of a synthetic season in the directory, generating
+    it unless it already exists.
+    """
+
+    file_name = os.path.join(directory, 'season-%s-x%s-%s.%s'
+                             % (year, scale, seed, file_format))
+    if not os.path.isfile(file_name):
+        rows = synthetic_season(scale, year, seed)
+        if file_format == 'xls':
+            write_xls(file_name, str(year), rows)
+        else:
+            write_csv(file_name, rows)
+    return file_name
+
+
+def time_import(importer_name, file_name, sheet_name):
+    """ Imports the file with an importer of IMPORTERS and returns its
+    end to end and per stage measurements.
+    """
+
+    start = time.time()
+    importer = IMPORTERS[importer_name](file_name, sheet_name)
+    seconds = time.time() - start
+    progress = importer.progress
+    return {
+        'seconds': seconds,
+        'rows': progress.rows,
+        'rejected': len(progress.rejected),
+        'imported': progress.imported,
+        'rows_per_second': progress.imported / max(seconds, 1e-6),
+        'queries': sum(stage['queries'] for stage in progress.stages.itervalues()),
+        'stages': progress.stages,
+    }
+
+
+def time_ratings():
+    """ Recomputes the ratings and returns the seconds it took. """
+
+    start = time.time()
+    ratings.recompute()
+    bump_data_generation()
+    return {'seconds': time.time() - start}
+
+
+def time_export():
+    """ Builds the columnar export and returns the seconds it took. """
+
+    start = time.time()
+    export.current_export()
+    return {'seconds': time.time() - start}
+
+
+def url_samples():
+    """ The values of the URL parameters, ids of the imported data. """
+
+    match_ids = list(Match.objects.order_by('id')
+                                  .values_list('id', flat=True)[:BATCH_SIZE])
+    match = Match.objects.get(pk=match_ids[0])
+    return {
+        'player_id': match.winner_id,
+        'player_a': match.winner_id,
+        'player_b': match.loser_id,
+        'tournament_id': Tournament.objects.order_by('id')[0].pk,
+        'match_id': match.pk,
+        'match_ids': ','.join(str(match_id) for match_id in match_ids),
+        'job_id': None,
+    }
+
+
+def url_paths(urlpatterns, samples):
+    """ The (name, path) pairs of the URL patterns.
+
+    The name is the pattern with its parameters in braces, so the reports
+    of different runs can be compared, the path has the sample values of the
+    parameters and the query string of QUERY_STRINGS. The included URL
+    configurations are requested at their root.
+    """
+
+    paths = []
+    for pattern in urlpatterns:
+        regex = pattern.regex.pattern.lstrip('^').rstrip('$').replace('\\', '')
+        name = '/' + URL_GROUP.sub(lambda m: '{%s}' % m.group(1), regex)
+        path = '/' + URL_GROUP.sub(lambda m: str(samples[m.group(1)]), regex)
+        if name in QUERY_STRINGS:
+            path += '?' + QUERY_STRINGS[name].format(**samples)
+        paths.append((name, path))
+    return paths
+
+
+def count_queries(paths):
+    """ Requests every path once with the test client and returns the
+    number of queries by name.
+
+    The cached responses are dropped first, so the counts are the ones of
+    the cold requests.
+    """
+
+    api_cache().clear()
+    client = Client()
+    counts = {}
+    debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    try:
+        for name, path in paths:
+            del connection.queries[:]
+            response = client.get(path)
+            if response.streaming:
+                for chunk in response.streaming_content:
+                    pass
+            counts[name] = len(connection.queries)
+    finally:
+        del connection.queries[:]
+        connection.use_debug_cursor = debug_cursor
+    return counts
+
+
+class ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    """ Serves every request in a new thread. """
+
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    """ Doesn't log the requests. """
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(application):
+    """ Serves the WSGI application on a free local port in a background
+    thread. Returns the server and its base URL.
+    """
+
+    server = make_server('127.0.0.1', 0, application,
+                         server_class=ThreadedWSGIServer,
+                         handler_class=QuietWSGIRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%s' % server.server_port
+
+
+def fetch(url):
+    """ Requests the URL and returns whether it succeeded, the client errors
+    (e.g. a missing id) count as successful responses.
+    """
+
+    try:
+        response = urllib2.urlopen(url)
+    except urllib2.HTTPError, e:
+        e.read()
+        return e.code < 500
+    except (urllib2.URLError, socket.error):
+        return False
+    try:
+        response.read()
+    finally:
+        response.close()
+    return True
+
+
+def drive(url, requests, concurrency):
+    """ Requests the URL the given number of times from concurrent threads.
+
+    Returns the throughput in requests per second, the latency percentiles
+    in milliseconds and the number of errors.
+    """
+
+    latencies = []
+    errors = [0]
+    remaining = [requests]
+    lock = threading.Lock()
+
+    def work():
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            ok = fetch(url)
+            latency = (time.time() - start) * 1000
+            with lock:
+                latencies.append(latency)
+                if not ok:
+                    errors[0] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=work) for _ in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors[0],
+        'throughput': requests / max(seconds, 1e-6),
+        'p50': quantile(latencies, 0.5),
+        'p95': quantile(latencies, 0.95),
+        'p99': quantile(latencies, 0.99),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """ The regressions of the report compared with the baseline report.
+
+    A timing regresses if it's worse by more than the tolerance (a fraction),
+    a count if it's higher at all. The imports and URLs missing from either
+    report are skipped.
+    """
+
+    regressions = []
+    for section, metrics in (('imports', IMPORT_METRICS), ('urls', URL_METRICS)):
+        previous_section = baseline.get(section, {})
+        for name, current in sorted(report.get(section, {}).iteritems()):
+            previous = previous_section.get(name)
+            if previous is None:
+                continue
+            for metric, higher_is_better in sorted(metrics.iteritems()):
+                old, new = previous.get(metric), current.get(metric)
+                if old is None or new is None:
+                    continue
+                allowed = 0 if metric in EXACT_METRICS else tolerance
+                if higher_is_better:
+                    worse = new < old * (1 - allowed)
+                else:
+                    worse = new > old * (1 + allowed)
+                if worse:
+                    regressions.append("%s %s %s: %.4g -> %.4g"
+                                       % (section, name, metric, old, new))
+    return regressions
@@ -0,0 +1,137 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from django.core.cache import get_cache
+from django.core.cache.backends.base import BaseCache
+from tennis_data.models import DataGeneration
+from tennis_data.settings import API_CACHE, API_GENERATION_CHECK_INTERVAL
+
+# The primary key of the single DataGeneration row
+GENERATION_ID = 1
+
+# The (generation, time it was read) pair of this process
+_generation = (None, 0.0)
+
+# Global in-memory store of cache data, keyed by the name of the cache like
+# in Django's LocMemCache.
+_caches = {}
+_locks = {}
+
+
+class LRUMemoryCache(BaseCache):
+    """ Thread-safe in-memory cache evicting the least recently used keys.
+
+    Unlike LocMemCache the values aren't pickled, they are shared between
+    the callers so they mustn't be mutated.
+    """
+
+    def __init__(self, name, params):
+        BaseCache.__init__(self, params)
+        self._cache = _caches.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, Lock())
+
+    def _get(self, key):
+        """ Returns the (expiry, value) pair of the key marking it as recently used. """
+
+        entry = self._cache.pop(key, None)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            return None
+        self._cache[key] = entry
+        return entry
+
+    def _set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expiry = time.time() + timeout
+        self._cache.pop(key, None)
+        while len(self._cache) >= self._max_entries:
+            self._cache.popitem(last=False)
+        self._cache[key] = (expiry, value)
+
+    def add(self, key, value, timeout=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._get(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, timeout=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._get(key) is not None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def api_cache():
+    """ The cache holding the encoded API responses. """
+
+    return get_cache(API_CACHE)
+
+
+def data_generation():
+    """ The number of the current data generation.
+
+    Every import starts a new generation, the cached responses of the
+    earlier ones are never used again. The generation is stored in the
+    database, so every process (web servers, workers, management commands)
+    sees the same one. A process reads it again at most every
+    API_GENERATION_CHECK_INTERVAL seconds. The first generation of a
+    database is a millisecond timestamp, so the generations of an earlier
+    database aren't reused.
+    """
+
+    global _generation
+    generation, checked = _generation
+    now = time.time()
+    if generation is not None and now - checked < API_GENERATION_CHECK_INTERVAL:
+        return generation
+    generation = DataGeneration.objects.get_or_create(
+        pk=GENERATION_ID, defaults={'generation': int(now * 1000)})[0].generation
+    _generation = (generation, now)
+    return generation
+
+
+def bump_data_generation():
+    """ Starts a new data generation, invalidating every cached response.
+
+    The generation follows the clock in milliseconds as long as it's
+    monotonic. The conditional update makes concurrent bumps start
+    different generations.
+    """
+
+    global _generation
+    while True:
+        _generation = (None, 0.0)
+        current = data_generation()
+        generation = max(int(time.time() * 1000), current + 1)
+        if DataGeneration.objects.filter(pk=GENERATION_ID, generation=current) \
+                                 .update(generation=generation):
+            _generation = (generation, time.time())
+            return generation
@@ -0,0 +1,176 @@
+import os
+import glob
+import errno
+import tempfile
+from collections import defaultdict
+import numpy as np
+from tennis_data.models import Match, Set, Odds, BOOKMAKERS
+from tennis_data.settings import API_EXPORT_CHUNK_SIZE, EXPORT_ROOT
+from tennis_data.cache import data_generation
+
+# The exported (column, match value) pairs and the numpy types of the columns
+MATCH_COLUMNS = (
+    ('id', 'id', np.int64),
+    ('date', 'date', 'datetime64[D]'),
+    ('round', 'round', np.unicode_),
+    ('status', 'status', np.unicode_),
+    ('winner_points', 'winner_points', np.int64),
+    ('loser_points', 'loser_points', np.int64),
+    ('tournament_id', 'tournament', np.int64),
+    ('tournament_atp_number', 'tournament__atp_number', np.int64),
+    ('tournament_name', 'tournament__name', np.unicode_),
+    ('tournament_location', 'tournament__location', np.unicode_),
+    ('tournament_series', 'tournament__series', np.unicode_),
+    ('tournament_court', 'tournament__court', np.unicode_),
+    ('tournament_surface', 'tournament__surface', np.unicode_),
+    ('tournament_best_of', 'tournament__best_of', np.int64),
+    ('winner_id', 'winner', np.int64),
+    ('winner_name', 'winner__name', np.unicode_),
+    ('loser_id', 'loser', np.int64),
+    ('loser_name', 'loser__name', np.unicode_),
+)
+SET_COUNT = 5
+ODDS_COLUMNS = tuple('%s_%s' % (prefix, side)
+                     for prefix in BOOKMAKERS + ('max', 'avg')
+                     for side in ('winner', 'loser'))
+
+
+def iterate_by_id(queryset, columns, chunk_size):
+    """ Iterates over the values of the columns in chunks ordered by id.
+
+    Every chunk is a separate query continuing after the last id of the
+    previous one, so neither the database driver nor Python holds more
+    than chunk_size rows at a time.
+    """
+
+    queryset = queryset.order_by('id').values(*columns)
+    last_id = None
+    while True:
+        chunk_queryset = queryset if last_id is None else queryset.filter(pk__gt=last_id)
+        rows = list(chunk_queryset[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]['id']
+
+
+def iterate_chunks(queryset, columns, chunk_size):
+    """ Like iterate_by_id but yields the lists of rows of the chunks. """
+
+    chunk = []
+    for row in iterate_by_id(queryset, columns, chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def chunk_columns(matches):
+    """ The columns of a chunk of match rows with their sets and odds. """
+
+    match_ids = [match['id'] for match in matches]
+    columns = {}
+    for name, value, dtype in MATCH_COLUMNS:
+        columns[name] = np.array([match[value] for match in matches], dtype=dtype)
+
+    games = np.empty((len(matches), SET_COUNT, 2), dtype=np.int64)
+    games.fill(-1)
+    positions = dict((match_id, i) for i, match_id in enumerate(match_ids))
+    set_data = Set.objects.filter(match__in=match_ids, set_number__lte=SET_COUNT) \
+                          .values_list('match', 'set_number',
+                                       'winner_games', 'loser_games')
+    for match_id, set_number, winner_games, loser_games in set_data:
+        games[positions[match_id], set_number - 1] = (winner_games, loser_games)
+    for i in xrange(SET_COUNT):
+        columns['w%s' % (i + 1)] = games[:, i, 0]
+        columns['l%s' % (i + 1)] = games[:, i, 1]
+
+    odds = np.empty((len(matches), len(ODDS_COLUMNS)))
+    odds.fill(np.nan)
+    odds_data = Odds.objects.filter(match__in=match_ids) \
+                            .values_list('match', *ODDS_COLUMNS)
+    for row in odds_data:
+        odds[positions[row[0]]] = row[1:]
+    for i, name in enumerate(ODDS_COLUMNS):
+        columns[name] = odds[:, i]
+    return columns
+
+
+def build(file_name, chunk_size=API_EXPORT_CHUNK_SIZE):
+    """ Writes the denormalized match table to a compressed npz file.
+
+    Every match is a row with its tournament, players, set scores (-1
+    for the unplayed sets) and odds (NaN without odds). The table is read
+    in chunks, three queries per chunk.
+    """
+
+    chunks = defaultdict(list)
+    values = [value for name, value, dtype in MATCH_COLUMNS]
+    for matches in iterate_chunks(Match.objects.all(), values, chunk_size):
+        for name, column in chunk_columns(matches).iteritems():
+            chunks[name].append(column)
+    if chunks:
+        columns = dict((name, np.concatenate(column_chunks))
+                       for name, column_chunks in chunks.iteritems())
+    else:
+        columns = chunk_columns([])
+    with open(file_name, 'wb') as export_file:
+        np.savez_compressed(export_file, **columns)
+
+
+def export_root():
+    """ The directory of the exports. """
+
+    return EXPORT_ROOT or os.path.join(tempfile.gettempdir(), 'tennis_data_exports')
+
+
+def export_name(generation):
+    """ The path of the export of a data generation. """
+
+    return os.path.join(export_root(), 'matches-%s.npz' % generation)
+
+
+def open_export():
+    """ Opens the export of the current data generation, None if it isn't
+    built yet.
+    """
+
+    try:
+        return open(export_name(data_generation()), 'rb')
+    except IOError, e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def current_export():
+    """ The path of the export of the current data generation, built if needed.
+
+    The file is written under a temporary name and renamed, so it's never
+    seen half written. The exports of the earlier generations are removed,
+    the readers which already opened one can still read it.
+    """
+
+    root = export_root()
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    generation = data_generation()
+    file_name = export_name(generation)
+    if os.path.isfile(file_name):
+        return file_name
+    fd, temp_name = tempfile.mkstemp(dir=root, suffix='.tmp')
+    os.close(fd)
+    try:
+        build(temp_name)
+        os.rename(temp_name, file_name)
+    except Exception:
+        os.remove(temp_name)
+        raise
+    for old_name in glob.glob(os.path.join(root, 'matches-*.npz')):
+        old_generation = os.path.basename(old_name)[len('matches-'):-len('.npz')]
+        if old_generation.isdigit() and int(old_generation) < generation:
+            os.remove(old_name)
+    return file_name
@@ -0,0 +1,214 @@
+import datetime
+import logging
+from collections import namedtuple
+from json import dumps, loads
+from traceback import format_exc
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from tennis_data.models import Job
+from tennis_data.settings import (JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY,
+                                  JOB_GROUP_CONCURRENCY, JOB_LEASE_TIMEOUT)
+from tennis_data.cache import bump_data_generation
+from tennis_data import tasks, stats, ratings, export
+
+logger = logging.getLogger('tennis_data.jobs')
+
+# A kind of job: the function running it with the job id and the arguments
+# of the job, and the group limiting how many of them run at once
+Task = namedtuple('Task', ('function', 'group'))
+
+
+def run_import(job_id, file_url=None, sheet_name=None):
+    """ Imports a datasource in bulk.
+
+    The bulk importer skips the rows it already imported, so a retried
+    import doesn't duplicate the matches of the failed attempt.
+    """
+
+    tasks.BulkPopulateDatabase(file_url, sheet_name, job_id=job_id)
+    enqueue_once('export')
+
+
+def run_rebuild_stats(job_id):
+    """ Recomputes the player statistics. """
+
+    stats.rebuild()
+    bump_data_generation()
+    enqueue_once('export')
+
+
+def run_compute_ratings(job_id):
+    """ Recomputes the Elo ratings. """
+
+    ratings.recompute()
+    bump_data_generation()
+    enqueue_once('export')
+
+
+def run_export(job_id):
+    """ Builds the columnar export of the current data generation. """
+
+    export.current_export()
+
+
+# The imports and the statistics rebuild write the same statistics, so they
+# share a group. The jobs changing the data queue an export of the new
+# data generation.
+TASKS = {
+    'import': Task(run_import, 'writes'),
+    'rebuild_stats': Task(run_rebuild_stats, 'writes'),
+    'compute_ratings': Task(run_compute_ratings, 'ratings'),
+    'export': Task(run_export, 'exports'),
+}
+
+
+def enqueue(kind, **arguments):
+    """ Queues a job of a kind of TASKS and returns it. """
+
+    if kind not in TASKS:
+        raise ValueError("Unknown job kind: %s" % kind)
+    now = timezone.now()
+    return Job.objects.create(kind=kind,
+                              arguments=dumps(arguments, sort_keys=True),
+                              max_attempts=JOB_MAX_ATTEMPTS,
+                              created=now, run_after=now)
+
+
+def enqueue_once(kind, **arguments):
+    """ Like enqueue but returns the queued or running job of the same kind
+    and arguments if there is one.
+    """
+
+    arguments_json = dumps(arguments, sort_keys=True)
+    pending = list(Job.objects.filter(status__in=(Job.QUEUED, Job.RUNNING),
+                                      kind=kind, arguments=arguments_json)
+                              .order_by('id')[:1])
+    if pending:
+        return pending[0]
+    return enqueue(kind, **arguments)
+
+
+def group_kinds(group):
+    """ The kinds of the jobs of a group. """
+
+    return [kind for kind, task in TASKS.iteritems() if task.group == group]
+
+
+def running_jobs(group):
+    """ The number of the running jobs of a group, by every worker. """
+
+    return Job.objects.filter(status=Job.RUNNING,
+                              kind__in=group_kinds(group)).count()
+
+
+def claim(worker):
+    """ Marks the oldest runnable job as running and returns it, None if
+    there is none.
+
+    The jobs of the groups running as many jobs as their concurrency allows
+    are skipped. The conditional update makes sure a job is claimed by one
+    worker only. If another worker filled the group meanwhile the job is
+    released again.
+    """
+
+    full_kinds = []
+    for group in set(task.group for task in TASKS.itervalues()):
+        if running_jobs(group) >= JOB_GROUP_CONCURRENCY.get(group, 1):
+            full_kinds.extend(group_kinds(group))
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.QUEUED, run_after__lte=now,
+                                    kind__in=list(TASKS)) \
+                            .exclude(kind__in=full_kinds) \
+                            .order_by('run_after', 'id') \
+                            .values_list('id', flat=True)
+    for job_id in candidates[:10]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.QUEUED) \
+                             .update(status=Job.RUNNING, worker=worker,
+                                     started=now, finished=None, heartbeat=now,
+                                     attempts=F('attempts') + 1)
+        if not claimed:
+            continue
+        job = Job.objects.get(pk=job_id)
+        group = TASKS[job.kind].group
+        if running_jobs(group) > JOB_GROUP_CONCURRENCY.get(group, 1):
+            Job.objects.filter(pk=job_id).update(status=Job.QUEUED, worker='',
+                                                 started=None,
+                                                 attempts=F('attempts') - 1)
+            return None
+        return job
+    return None
+
+
+def fail(job, error):
+    """ Records a failed attempt of a running job.
+
+    The job is queued again with an exponentially growing delay until it
+    runs out of attempts.
+    """
+
+    logger.error("%s failed (attempt %s of %s):\n%s", job, job.attempts,
+                 job.max_attempts, error)
+    running = Job.objects.filter(pk=job.pk, status=Job.RUNNING)
+    if job.attempts < job.max_attempts:
+        delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        running.update(status=Job.QUEUED, error=error, run_after=run_after)
+    else:
+        running.update(status=Job.FAILED, error=error, finished=timezone.now())
+
+
+def run(job_id):
+    """ Runs a claimed job and records its outcome. """
+
+    job = Job.objects.get(pk=job_id)
+    try:
+        TASKS[job.kind].function(job.pk, **loads(job.arguments))
+    except Exception:
+        # A failed query aborts the transaction on PostgreSQL and nothing
+        # rolls it back outside of a request.
+        transaction.rollback()
+        fail(job, format_exc())
+        return
+    Job.objects.filter(pk=job.pk).update(status=Job.FINISHED,
+                                         finished=timezone.now())
+    logger.info("%s finished", job)
+
+
+def crashed(job_id, exitcode):
+    """ Records the failure of a job whose process died before recording
+    its outcome, e.g. killed for using too much memory.
+    """
+
+    job = Job.objects.get(pk=job_id)
+    if job.status == Job.RUNNING:
+        fail(job, "The process of the job exited with code %s" % exitcode)
+
+
+def heartbeat(job_ids):
+    """ Marks the running jobs alive. """
+
+    if job_ids:
+        Job.objects.filter(pk__in=job_ids, status=Job.RUNNING) \
+                   .update(heartbeat=timezone.now())
+
+
+def requeue_orphans(worker=None):
+    """ Queues again the jobs left running by a dead worker.
+
+    These are the jobs of a stopped worker of the given name and the jobs
+    of any worker whose heartbeat expired JOB_LEASE_TIMEOUT seconds ago,
+    e.g. on a host that never came back. The jobs without attempts left
+    fail, so a job killing its worker can't loop forever.
+    """
+
+    now = timezone.now()
+    expired = now - datetime.timedelta(seconds=JOB_LEASE_TIMEOUT)
+    dead = Q(heartbeat__lt=expired)
+    if worker is not None:
+        dead |= Q(worker=worker)
+    orphans = Job.objects.filter(dead, status=Job.RUNNING)
+    orphans.filter(attempts__gte=F('max_attempts')) \
+           .update(status=Job.FAILED, finished=now,
+                   error="The worker stopped while running the job")
+    return orphans.update(status=Job.QUEUED, run_after=now)
@@ -0,0 +1,38 @@
+import datetime
+from json import dumps
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from tennis_data import analytics
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError("%s isn't a YYYY-MM-DD date" % value)
+
+
+class Command(BaseCommand):
+    help = "Prints the bookmaker margins and strategy backtests of the matches as JSON."
+    option_list = BaseCommand.option_list + (
+        make_option('--from', dest='date_from', default=None,
+                    help="The first day of the analysed matches (YYYY-MM-DD)."),
+        make_option('--to', dest='date_to', default=None,
+                    help="The last day of the analysed matches (YYYY-MM-DD)."),
+        make_option('--surface', dest='surface', default=None),
+        make_option('--series', dest='series', default=None),
+        make_option('--threshold', dest='threshold', type='float', default=3.0,
+                    help="The minimal odds backed by the threshold strategy."),
+    )
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['date_from']:
+            filters['date__gte'] = parse_date(options['date_from'])
+        if options['date_to']:
+            filters['date__lte'] = parse_date(options['date_to'])
+        for name in ('surface', 'series'):
+            if options[name]:
+                filters['tournament__' + name] = options[name]
+        result = analytics.analyze(filters, options['threshold'])
+        self.stdout.write(dumps(result, indent=2, sort_keys=True))
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import datetime
+from json import dumps, load
+from optparse import make_option
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from tennis_data import benchmark, jobs, export
+from tennis_data.urls import urlpatterns
+
+
+class Command(BaseCommand):
+    """ Benchmarks the imports and the URLs on a synthetic season.
+
+    The work is done in a test database created for the run and destroyed
+    afterwards, like the one of the test runner. Every importer imports the
+    season into an emptied database, the URLs are requested on the data of
+    the last one: once by the test client to count the queries of the cold
+    requests, then concurrently through a local WSGI server to measure the
+    throughput and the latencies of the (mostly cached) responses. The
+    client threads share the process with the server, so the numbers are
+    only comparable between runs on the same machine.
+    """
+
+    help = ("Times the imports of a synthetic season and the URLs of the "
+            "site, and reports them as JSON.")
+    option_list = BaseCommand.option_list + (
+        make_option('--scale', dest='scale', type='float', default=1.0,
+                    help="The size of the season relative to a real one."),
+        make_option('--format', dest='format', default='csv',
+                    choices=('csv', 'xls'),
+                    help="The format of the season, xls needs xlwt."),
+        make_option('--year', dest='year', type='int', default=2011,
+                    help="The year of the season."),
+        make_option('--seed', dest='seed', type='int', default=0,
+                    help="The seed of the generated season."),
+        make_option('--fixtures-dir', dest='fixtures_dir', default=None,
+                    help="Keep the generated seasons in this directory and "
+                         "reuse them on later runs."),
+        make_option('--importer', dest='importers', action='append',
+                    default=None, choices=sorted(benchmark.IMPORTERS),
+                    help="The importer to time, can be given multiple times. "
+                         "Defaults to bulk."),
+        make_option('--requests', dest='requests', type='int', default=50,
+                    help="The number of requests per URL."),
+        make_option('--concurrency', dest='concurrency', type='int', default=4,
+                    help="The number of concurrent clients."),
+        make_option('--output', dest='output', default=None,
+                    help="Write the report to this file instead of the "
+                         "standard output."),
+        make_option('--baseline', dest='baseline', default=None,
+                    help="Compare the report with this earlier report and "
+                         "fail on regressions."),
+        make_option('--tolerance', dest='tolerance', type='float', default=0.2,
+                    help="The allowed slowdown of the timings compared with "
+                         "the baseline, as a fraction."),
+    )
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0:
+            raise CommandError("--scale has to be positive")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency have to be positive")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = load(baseline_file)
+
+        work_dir = tempfile.mkdtemp()
+        try:
+            fixtures_dir = options['fixtures_dir'] or work_dir
+            if not os.path.isdir(fixtures_dir):
+                os.makedirs(fixtures_dir)
+            try:
+                file_name = benchmark.season_fixture(
+                    fixtures_dir, options['scale'], options['year'],
+                    options['format'], options['seed'])
+            except ValueError, e:
+                raise CommandError(e)
+            report = self.run(file_name, work_dir, options)
+        finally:
+            shutil.rmtree(work_dir)
+
+        text = dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(text)
+        else:
+            self.stdout.write(text)
+        if baseline is not None:
+            regressions = benchmark.compare(report, baseline, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError("%s regressions compared with %s"
+                                   % (len(regressions), options['baseline']))
+
+    def run(self, file_name, work_dir, options):
+        """ Runs the benchmarks in a test database and returns the report. """
+
+        # An in-memory SQLite database isn't shared by the server threads.
+        if (connection.vendor == 'sqlite' and
+                not connection.settings_dict.get('TEST_NAME')):
+            connection.settings_dict['TEST_NAME'] = \
+                os.path.join(work_dir, 'benchmark.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        # The exports of the test database mustn't replace the real ones.
+        export_root = export.EXPORT_ROOT
+        export.EXPORT_ROOT = os.path.join(work_dir, 'exports')
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = {
+                'created': datetime.datetime.now().isoformat(),
+                'scale': options['scale'],
+                'format': options['format'],
+                'database': connection.vendor,
+                'debug': settings.DEBUG,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'imports': {},
+            }
+            for importer_name in options['importers'] or ['bulk']:
+                call_command('flush', interactive=False, verbosity=0)
+                report['imports'][importer_name] = benchmark.time_import(
+                    importer_name, file_name, str(options['year']))
+            report['ratings'] = benchmark.time_ratings()
+            report['export'] = benchmark.time_export()
+
+            samples = benchmark.url_samples()
+            samples['job_id'] = jobs.enqueue('compute_ratings').pk
+            paths = benchmark.url_paths(urlpatterns, samples)
+            queries = benchmark.count_queries(paths)
+            server, base_url = benchmark.serve(get_wsgi_application())
+            try:
+                report['urls'] = {}
+                for name, path in paths:
+                    result = benchmark.drive(base_url + path, options['requests'],
+                                             options['concurrency'])
+                    result['queries'] = queries[name]
+                    report['urls'][name] = result
+            finally:
+                server.shutdown()
+                server.server_close()
+            return report
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            export.EXPORT_ROOT = export_root
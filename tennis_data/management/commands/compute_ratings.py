@@ -0,0 +1,14 @@
+import time
+from django.core.management.base import NoArgsCommand
+from tennis_data import ratings
+from tennis_data.cache import bump_data_generation
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the Elo ratings from the whole match history."
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        count = ratings.recompute()
+        bump_data_generation()
+        self.stdout.write("Rated %s matches in %.2fs" % (count, time.time() - start))
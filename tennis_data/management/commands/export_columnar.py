@@ -0,0 +1,20 @@
+import shutil
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from tennis_data.export import current_export
+
+
+class Command(BaseCommand):
+    help = ("Builds the columnar (npz) export of the matches served at "
+            "/api/export/matches.npz unless it's already up to date.")
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+                    help="Copy the export to this path as well."),
+    )
+
+    def handle(self, *args, **options):
+        file_name = current_export()
+        if options['output']:
+            shutil.copyfile(file_name, options['output'])
+            file_name = options['output']
+        self.stdout.write(file_name)
@@ -0,0 +1,73 @@
+import datetime
+from multiprocessing import Pool, cpu_count
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tennis_data.tasks import (BulkPopulateDatabase, SEASON_URLS,
+                               season_source, parse_season)
+
+
+class Command(BaseCommand):
+    """ Imports several seasons of several tours.
+
+    The workbooks are downloaded and parsed by a pool of processes, the
+    parsed rows are written by this process in batches as they arrive.
+    """
+
+    help = "Imports the seasons between --from and --to of the given tours."
+    option_list = BaseCommand.option_list + (
+        make_option('--from', dest='from_year', type='int',
+                    default=datetime.date.today().year,
+                    help="The first season to import."),
+        make_option('--to', dest='to_year', type='int', default=None,
+                    help="The last season to import, defaults to --from."),
+        make_option('--tour', dest='tours', action='append', default=None,
+                    choices=sorted(SEASON_URLS),
+                    help="The tour to import, can be given multiple times. "
+                         "Defaults to atp."),
+        make_option('--processes', dest='processes', type='int',
+                    default=cpu_count(),
+                    help="The number of parsing processes."),
+        make_option('--cache-dir', dest='cache_dir', default=None,
+                    help="Keep the downloaded archives in this directory and "
+                         "reuse them on later imports."),
+    )
+
+    def handle(self, *args, **options):
+        from_year = options['from_year']
+        to_year = options['to_year'] or from_year
+        if to_year < from_year:
+            raise CommandError("--to can't be earlier than --from")
+        sources = [season_source(year, tour) + (options['cache_dir'],)
+                   for year in xrange(from_year, to_year + 1)
+                   for tour in options['tours'] or ['atp']]
+
+        # The forked workers mustn't share the connection of the writer.
+        connection.close()
+        pool = Pool(max(1, min(options['processes'], len(sources))))
+        writer = BulkPopulateDatabase(autorun=False)
+        failed = 0
+        try:
+            for source, records, progress, error in pool.imap_unordered(parse_season,
+                                                                        sources):
+                if error is not None:
+                    failed += 1
+                    progress.finish(error)
+                    self.stderr.write("%s failed: %s" % (source[0], error))
+                    continue
+                try:
+                    # The failure is recorded by the progress before it's
+                    # raised again
+                    with progress.running():
+                        writer.populate(records, progress)
+                except Exception, e:
+                    failed += 1
+                    self.stderr.write("%s failed: %s: %s"
+                                      % (source[0], e.__class__.__name__, e))
+                    continue
+                self.stdout.write("%s: %s rows imported" % (source[0], len(records)))
+        finally:
+            pool.close()
+            pool.join()
+        if failed:
+            raise CommandError("%s of %s seasons failed" % (failed, len(sources)))
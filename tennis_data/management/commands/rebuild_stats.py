@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+from tennis_data import stats
+from tennis_data.cache import bump_data_generation
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the player statistics from the stored matches."
+
+    def handle_noargs(self, **options):
+        stats.rebuild()
+        bump_data_generation()
@@ -0,0 +1,86 @@
+import time
+import socket
+from multiprocessing import Process
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from tennis_data import jobs
+from tennis_data.settings import (JOB_CONCURRENCY, JOB_POLL_INTERVAL,
+                                  JOB_HEARTBEAT_INTERVAL)
+
+
+class Command(BaseCommand):
+    """ Runs the queued jobs, each in a process of its own.
+
+    This process claims the jobs, starts their processes and renews the
+    heartbeat of the running ones. The concurrency of the job groups is
+    respected across every worker. A job whose process dies without
+    recording its outcome fails like a raising one.
+
+    The jobs left running by a previous instance of the same name are
+    queued again at startup, so the names of the instances running at the
+    same time must differ. The jobs of any worker whose heartbeat expired
+    are queued again too.
+    """
+
+    help = "Runs the jobs of the queue until interrupted."
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=JOB_CONCURRENCY,
+                    help="The number of jobs run at once."),
+        make_option('--name', dest='name', default=socket.gethostname(),
+                    help="The name of this worker, defaults to the host name."),
+        make_option('--poll', dest='poll', type='float',
+                    default=JOB_POLL_INTERVAL,
+                    help="Seconds between the checks of an idle queue."),
+        make_option('--once', dest='once', action='store_true', default=False,
+                    help="Exit when there are no more runnable jobs."),
+    )
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if concurrency < 1:
+            raise CommandError("--concurrency has to be positive")
+        name = options['name']
+
+        requeued = jobs.requeue_orphans(name)
+        if requeued:
+            self.stdout.write("Queued %s orphaned jobs again" % requeued)
+        running = {}
+        last_heartbeat = time.time()
+        try:
+            while True:
+                for job_id, process in running.items():
+                    if not process.is_alive():
+                        process.join()
+                        del running[job_id]
+                        if process.exitcode != 0:
+                            self.stderr.write("Job %s crashed" % job_id)
+                            jobs.crashed(job_id, process.exitcode)
+                if time.time() - last_heartbeat >= JOB_HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.time()
+                    jobs.heartbeat(list(running))
+                    requeued = jobs.requeue_orphans()
+                    if requeued:
+                        self.stdout.write("Queued %s orphaned jobs again"
+                                          % requeued)
+                job = None
+                if len(running) < concurrency:
+                    job = jobs.claim(name)
+                if job is not None:
+                    self.stdout.write("Running %s" % job)
+                    # The forked process mustn't share the connection of
+                    # this one.
+                    connection.close()
+                    process = Process(target=jobs.run, args=(job.pk,))
+                    process.start()
+                    running[job.pk] = process
+                elif options['once'] and not running:
+                    break
+                else:
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            for process in running.itervalues():
+                process.terminate()
+        for process in running.itervalues():
+            process.join()
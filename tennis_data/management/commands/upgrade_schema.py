@@ -0,0 +1,110 @@
+import re
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import get_app, get_models
+
+# The SQL expressions filling the new NOT NULL columns of the existing rows,
+# by (model name, field name)
+BACKFILLS = {
+    ('Match', 'pair_low'):
+        'CASE WHEN winner_id < loser_id THEN winner_id ELSE loser_id END',
+    ('Match', 'pair_high'):
+        'CASE WHEN winner_id < loser_id THEN loser_id ELSE winner_id END',
+}
+
+INDEX_NAME = re.compile(r'CREATE INDEX "?(\w+)"?')
+
+
+def index_names(cursor):
+    """ The names of the indexes of the database. """
+
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT indexname FROM pg_indexes")
+    elif connection.vendor == 'sqlite':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    else:
+        raise CommandError("Only PostgreSQL and SQLite databases are supported")
+    return set(row[0] for row in cursor.fetchall())
+
+
+def column_statements(model, field):
+    """ The statements adding the column of a field to an existing table.
+
+    The column is added as nullable, a NOT NULL column is filled by its
+    BACKFILLS expression and made NOT NULL where the database can alter
+    a column.
+    """
+
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    column = qn(field.column)
+    statements = ['ALTER TABLE %s ADD COLUMN %s %s NULL'
+                  % (table, column, field.db_type(connection))]
+    if not field.null:
+        backfill = BACKFILLS.get((model.__name__, field.name))
+        if backfill is None:
+            raise CommandError("No value is known for the existing rows of "
+                               "the new %s.%s column" % (model.__name__, field.name))
+        statements.append('UPDATE %s SET %s = %s' % (table, column, backfill))
+        if connection.vendor == 'postgresql':
+            statements.append('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL'
+                              % (table, column))
+    return statements
+
+
+def upgrade_statements():
+    """ The statements adding the columns and the indexes missing from the
+    existing tables of the models.
+
+    syncdb only creates the missing tables, the ones created by an earlier
+    version of the models lack the columns and the indexes added since.
+    """
+
+    cursor = connection.cursor()
+    tables = connection.introspection.table_names(cursor)
+    indexes = index_names(cursor)
+    statements = []
+    for model in get_models(get_app('tennis_data')):
+        table = model._meta.db_table
+        if table not in tables:
+            continue
+        columns = set(row[0] for row in
+                      connection.introspection.get_table_description(cursor, table))
+        for field in model._meta.local_fields:
+            if field.column not in columns:
+                statements.extend(column_statements(model, field))
+        for sql in connection.creation.sql_indexes_for_model(model, no_style()):
+            if INDEX_NAME.match(sql).group(1) not in indexes:
+                statements.append(sql.rstrip(';'))
+    return statements
+
+
+class Command(BaseCommand):
+    """ Brings the tables created by an earlier version of the models up to
+    date.
+
+    Run syncdb first, it creates the new tables with their indexes. The
+    statements are run in one transaction, running the command again does
+    nothing.
+    """
+
+    help = "Adds the missing columns and indexes to the existing tables."
+    option_list = BaseCommand.option_list + (
+        make_option('--print', dest='print_only', action='store_true',
+                    default=False,
+                    help="Print the SQL statements instead of running them."),
+    )
+
+    def handle(self, *args, **options):
+        statements = upgrade_statements()
+        if options['print_only']:
+            for sql in statements:
+                self.stdout.write(sql + ';')
+            return
+        with transaction.commit_on_success():
+            cursor = connection.cursor()
+            for sql in statements:
+                cursor.execute(sql)
+        self.stdout.write("%s statements run" % len(statements))
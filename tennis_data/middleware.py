@@ -0,0 +1,128 @@
+import time
+import random
+import logging
+from collections import defaultdict, deque
+from threading import Lock
+from django.conf import settings
+from django.db import connection
+from tennis_data.settings import (API_METRICS_SAMPLE_RATE, API_METRICS_WINDOW,
+                                  API_SLOW_REQUEST_MS)
+
+INSTRUMENTED_MODULE = 'tennis_data.api'
+
+# The (metric, help) pairs of the exported summaries, the database metrics
+# only count the sampled requests
+METRICS = (
+    ('request_seconds', "Wall time of the API requests."),
+    ('response_bytes', "Size of the API responses, 0 if streamed."),
+    ('db_seconds', "Database time of the sampled API requests."),
+    ('queries', "Number of queries of the sampled API requests."),
+    ('duplicate_queries', "Number of repeated queries of the sampled API requests."),
+)
+QUANTILES = (0.5, 0.9, 0.99)
+
+logger = logging.getLogger('tennis_data.slow_requests')
+
+# The per process store of the measurements, view name -> metric ->
+# [count, sum, the last API_METRICS_WINDOW values]
+_metrics = defaultdict(lambda: defaultdict(
+    lambda: [0, 0.0, deque(maxlen=API_METRICS_WINDOW)]))
+_lock = Lock()
+
+
+def record(view, values):
+    """ Adds the metric -> value pairs of a request of the view. """
+
+    with _lock:
+        for metric, value in values.iteritems():
+            summary = _metrics[view][metric]
+            summary[0] += 1
+            summary[1] += value
+            summary[2].append(value)
+
+
+def quantile(values, q):
+    """ The nearest-rank q quantile of the sorted values. """
+
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def prometheus_text():
+    """ The recorded metrics in the Prometheus text exposition format. """
+
+    with _lock:
+        snapshot = dict((view, dict((metric, (count, total, sorted(window)))
+                                    for metric, (count, total, window)
+                                    in view_metrics.iteritems()))
+                        for view, view_metrics in _metrics.iteritems())
+    lines = []
+    for metric, help_text in METRICS:
+        name = 'tennis_data_api_%s' % metric
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s summary' % name)
+        for view in sorted(snapshot):
+            if metric not in snapshot[view]:
+                continue
+            count, total, window = snapshot[view][metric]
+            for q in QUANTILES:
+                lines.append('%s{view="%s",quantile="%s"} %r'
+                             % (name, view, q, float(quantile(window, q))))
+            lines.append('%s_sum{view="%s"} %r' % (name, view, float(total)))
+            lines.append('%s_count{view="%s"} %s' % (name, view, count))
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentationMiddleware(object):
+    """ Measures the views of the API.
+
+    The wall time and the response size of every request are recorded.
+    A sampled request also records its queries through the debug cursor of
+    the connection, which is only switched on for it, so without sampling
+    the overhead is two clock reads. With DEBUG the queries are captured
+    anyway and every request is sampled.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func.__module__ != INSTRUMENTED_MODULE:
+            return None
+        debug_cursor = connection.use_debug_cursor
+        sampled = (debug_cursor or (debug_cursor is None and settings.DEBUG) or
+                   random.random() < API_METRICS_SAMPLE_RATE)
+        request._instrumentation = {
+            'view': view_func.__name__,
+            'sampled': sampled,
+            'debug_cursor': debug_cursor,
+            'first_query': len(connection.queries),
+            'start': time.time(),
+        }
+        if sampled:
+            connection.use_debug_cursor = True
+        return None
+
+    def process_response(self, request, response):
+        state = getattr(request, '_instrumentation', None)
+        if state is None:
+            return response
+        values = {'request_seconds': time.time() - state['start']}
+        if getattr(response, 'streaming', False):
+            values['response_bytes'] = 0
+        else:
+            values['response_bytes'] = len(response.content)
+        queries = []
+        if state['sampled']:
+            connection.use_debug_cursor = state['debug_cursor']
+            queries = connection.queries[state['first_query']:]
+            values['db_seconds'] = sum(float(query['time']) for query in queries)
+            values['queries'] = len(queries)
+            values['duplicate_queries'] = \
+                len(queries) - len(set(query['sql'] for query in queries))
+        record(state['view'], values)
+        if (API_SLOW_REQUEST_MS is not None and
+                values['request_seconds'] * 1000 >= API_SLOW_REQUEST_MS):
+            logger.warning("Slow request %s (%s): %.0f ms, %s queries%s",
+                           request.get_full_path(), state['view'],
+                           values['request_seconds'] * 1000,
+                           len(queries) if state['sampled'] else 'unsampled',
+                           ''.join('\n  %ss %s' % (query['time'], query['sql'])
+                                   for query in queries))
+        return response
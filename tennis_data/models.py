@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, connection, transaction
 from django.core.validators import MinValueValidator
-from tennis_data.settings import EPS
+from tennis_data.settings import EPS, ODDS_REFRESH_BATCH_SIZE
+from tennis_data.utils import chunked
 
 
 class Tournament(models.Model):
@@ -9,9 +10,9 @@ class Tournament(models.Model):
     atp_number = models.PositiveIntegerField()
     name = models.CharField(max_length=60)
     location = models.CharField(max_length=60)
-    series = models.CharField(max_length=60)
+    series = models.CharField(max_length=60, db_index=True)
     court = models.CharField(max_length=60)
-    surface = models.CharField(max_length=60)
+    surface = models.CharField(max_length=60, db_index=True)
     best_of = models.PositiveIntegerField()
 
     def __unicode__(self):
@@ -34,6 +35,9 @@ class Ranking(models.Model):
     tournament = models.ForeignKey('Tournament', related_name="ranking_of")
     rank = models.PositiveIntegerField()
 
+    class Meta:
+        index_together = [['tournament', 'player']]
+
 
 class Match(models.Model):
     """ Details of a match. """
@@ -41,14 +45,29 @@ class Match(models.Model):
     winner = models.ForeignKey('Player', related_name="winner_of")
     loser = models.ForeignKey('Player', related_name="loser_of")
     tournament = models.ForeignKey('Tournament', related_name="match_of")
-    date = models.DateField()
-    round = models.CharField(max_length=60)
+    date = models.DateField(db_index=True)
+    round = models.CharField(max_length=60, db_index=True)
     winner_points = models.PositiveIntegerField()
     loser_points = models.PositiveIntegerField()
     status = models.CharField(max_length=60)
+    # The players ordered by id, maintained by save for the head-to-head index
+    pair_low = models.ForeignKey('Player', related_name='+', db_index=False)
+    pair_high = models.ForeignKey('Player', related_name='+', db_index=False)
 
     class Meta:
         verbose_name_plural = "Matches"
+        index_together = [['pair_low', 'pair_high', 'date']]
+
+    @staticmethod
+    def pair(winner_id, loser_id):
+        """ The (pair_low, pair_high) ids of a match of the players. """
+
+        return min(winner_id, loser_id), max(winner_id, loser_id)
+
+    def save(self, *args, **kwargs):
+        self.pair_low_id, self.pair_high_id = self.pair(self.winner_id,
+                                                        self.loser_id)
+        super(Match, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return u'%s(W) vs. %s(L) @ %s %s' % (self.winner,
@@ -72,11 +91,104 @@ class Set(models.Model):
                                        self.loser_games)
 
 
+class PlayerStats(models.Model):
+    """ The statistics of a player in a season on a surface, maintained by the importer. """
+
+    player = models.ForeignKey('Player', related_name="stats_of")
+    season = models.PositiveIntegerField()
+    surface = models.CharField(max_length=60)
+    wins = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    sets_won = models.PositiveIntegerField(default=0)
+    sets_lost = models.PositiveIntegerField(default=0)
+    games_won = models.PositiveIntegerField(default=0)
+    games_lost = models.PositiveIntegerField(default=0)
+    tiebreaks_won = models.PositiveIntegerField(default=0)
+    tiebreaks_lost = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('player', 'season', 'surface'),)
+        verbose_name_plural = "Player stats"
+
+
+class PlayerRating(models.Model):
+    """ The current Elo rating of a player, overall (empty surface) or on a surface. """
+
+    player = models.ForeignKey('Player', related_name="rating_of")
+    surface = models.CharField(max_length=60, blank=True)
+    rating = models.FloatField()
+    matches = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (('player', 'surface'),)
+        index_together = [['surface', 'rating']]
+
+
+class RatingSnapshot(models.Model):
+    """ The Elo ratings of the players of a match before it was played. """
+
+    match = models.OneToOneField('Match', related_name="rating_snapshot_of")
+    winner_rating = models.FloatField()
+    loser_rating = models.FloatField()
+    winner_surface_rating = models.FloatField()
+    loser_surface_rating = models.FloatField()
+
+
 DEFAULT_ODD = 1.0 + EPS
 
+# The bookmakers having their own columns in Odds
+BOOKMAKERS = ('b365', 'ex', 'lb', 'ps', 'sj')
+
+
+class OddsManager(models.Manager):
+    def refresh(self, match_ids):
+        """ Recomputes the odds of the matches from their BookmakerOdds.
+
+        A single set-based UPDATE fills the bookmaker columns and the max
+        and avg aggregates, the missing values are set to DEFAULT_ODD.
+        """
+
+        if not match_ids:
+            return
+        qn = connection.ops.quote_name
+        odds_table = qn(self.model._meta.db_table)
+        bookmaker_odds_table = qn(BookmakerOdds._meta.db_table)
+        bookmaker_table = qn(Bookmaker._meta.db_table)
+        assignments = []
+        params = []
+        for bookmaker in BOOKMAKERS:
+            for side in ('winner', 'loser'):
+                assignments.append(
+                    '%s = COALESCE((SELECT bo.%s FROM %s bo INNER JOIN %s b '
+                    'ON b.id = bo.bookmaker_id WHERE bo.match_id = %s.match_id '
+                    'AND b.name = %%s), %%s)' % (
+                        qn('%s_%s' % (bookmaker, side)), qn(side + '_odd'),
+                        bookmaker_odds_table, bookmaker_table, odds_table))
+                params.extend([bookmaker, DEFAULT_ODD])
+        for aggregate in ('max', 'avg'):
+            for side in ('winner', 'loser'):
+                assignments.append(
+                    '%s = COALESCE((SELECT %s(bo.%s) FROM %s bo '
+                    'WHERE bo.match_id = %s.match_id), %%s)' % (
+                        qn('%s_%s' % (aggregate, side)), aggregate.upper(),
+                        qn(side + '_odd'), bookmaker_odds_table, odds_table))
+                params.append(DEFAULT_ODD)
+        match_ids = list(match_ids)
+        cursor = connection.cursor()
+        for ids_chunk in chunked(match_ids, ODDS_REFRESH_BATCH_SIZE):
+            cursor.execute('UPDATE %s SET %s WHERE %s.match_id IN (%s)' % (
+                odds_table, ', '.join(assignments), odds_table,
+                ', '.join(['%s'] * len(ids_chunk))), params + ids_chunk)
+        transaction.commit_unless_managed()
+
 
 class Odds(models.Model):
-    """ Odds for a given match by various gambling companies. """
+    """ Odds for a given match by various gambling companies.
+
+    The compatibility shape of BookmakerOdds: the columns of the original
+    bookmakers and the aggregates over every bookmaker are filled by
+    Odds.objects.refresh.
+    """
 
     match = models.ForeignKey('Match', related_name="odds_of")
     b365_winner = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
@@ -99,26 +211,141 @@ class Odds(models.Model):
                                   default=DEFAULT_ODD)
     sj_loser = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
                                  default=DEFAULT_ODD)
-    max_winner = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
-    max_loser = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
-    avg_winner = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
-    avg_loser = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
-
-    def save(self):
-        """ Calculating the max and avg values for the winners and losers. """
-
-        winner_list = [self.b365_winner, self.ex_winner,
-                       self.lb_winner, self.ps_winner,
-                       self.sj_winner]
-        loser_list = [self.b365_loser, self.ex_loser,
-                      self.lb_loser, self.ps_loser,
-                      self.sj_loser]
-
-        self.max_winner = max(winner_list)
-        self.max_loser = max(loser_list)
-        self.avg_winner = sum(winner_list) / len(winner_list)
-        self.avg_loser = sum(loser_list) / len(loser_list)
-        super(Odds, self).save()
+    max_winner = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
+                                   default=DEFAULT_ODD)
+    max_loser = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
+                                  default=DEFAULT_ODD)
+    avg_winner = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
+                                   default=DEFAULT_ODD)
+    avg_loser = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)],
+                                  default=DEFAULT_ODD)
+
+    objects = OddsManager()
 
     class Meta:
         verbose_name_plural = "Oddses"
+
+
+class ImportedRow(models.Model):
+    """ The ledger of the imported spreadsheet rows.
+
+    The key identifies the match of the row, the fingerprint is the hash of
+    all of its columns, so re-imports can skip the unchanged rows.
+    """
+
+    key = models.CharField(max_length=40, unique=True)
+    fingerprint = models.CharField(max_length=40)
+    match = models.ForeignKey('Match', related_name="imported_row_of")
+
+
+class Bookmaker(models.Model):
+    """ A gambling company, named after the column prefix in the datasource. """
+
+    name = models.CharField(max_length=20, unique=True)
+
+    def __unicode__(self):
+        return unicode(self.name)
+
+
+class BookmakerOdds(models.Model):
+    """ The odds of a bookmaker for a match. """
+
+    match = models.ForeignKey('Match', related_name="bookmaker_odds_of")
+    bookmaker = models.ForeignKey('Bookmaker', related_name="odds_of")
+    winner_odd = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
+    loser_odd = models.FloatField(validators=[MinValueValidator(DEFAULT_ODD)])
+
+    class Meta:
+        unique_together = (('match', 'bookmaker'),)
+        verbose_name_plural = "Bookmaker odds"
+
+
+class ImportRun(models.Model):
+    """ The timings of an import.
+
+    The stages field is a JSON object mapping the stage names to their
+    seconds and query counts.
+    """
+
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((FINISHED, 'Finished'), (FAILED, 'Failed'))
+
+    source = models.CharField(max_length=255)
+    layout = models.CharField(max_length=20, blank=True)
+    started = models.DateTimeField(db_index=True)
+    finished = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    rows = models.PositiveIntegerField()
+    rejected = models.PositiveIntegerField()
+    imported = models.PositiveIntegerField()
+    seconds = models.FloatField()
+    queries = models.PositiveIntegerField()
+    stages = models.TextField()
+    error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.source, self.started)
+
+
+class QuarantinedRow(models.Model):
+    """ A malformed row left out of an import.
+
+    The number is the row number in the datasource counting the header as
+    the first, values is a JSON object of its raw values by field.
+    """
+
+    run = models.ForeignKey('ImportRun', related_name="quarantined_row_of")
+    number = models.PositiveIntegerField()
+    reason = models.CharField(max_length=255)
+    values = models.TextField()
+
+
+class Job(models.Model):
+    """ A task queued for the workers of the run_workers command.
+
+    The arguments field is a JSON object of the keyword arguments of the
+    task. A failed job is queued again with a delay until it runs out of
+    attempts. The worker running a job renews its heartbeat. The imports
+    report their progress in done and total.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'),
+                      (FINISHED, 'Finished'), (FAILED, 'Failed'))
+
+    kind = models.CharField(max_length=30)
+    arguments = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField()
+    created = models.DateTimeField()
+    run_after = models.DateTimeField()
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    done = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    import_run = models.ForeignKey('ImportRun', related_name="job_of",
+                                   null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        index_together = [['status', 'run_after']]
+
+    def __unicode__(self):
+        return u'%s #%s' % (self.kind, self.pk)
+
+
+class DataGeneration(models.Model):
+    """ The current data generation, a single row shared by every process.
+
+    See cache.data_generation.
+    """
+
+    generation = models.BigIntegerField()
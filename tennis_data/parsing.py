@@ -0,0 +1,302 @@
+import os
+import csv
+import datetime
+from collections import namedtuple
+from itertools import izip
+from xlrd import open_workbook, xldate_as_tuple, XLDateError
+
+# The fields of a row, in the order of the 2011 ATP layout
+FIELDS = ('atp', 'location', 'tournament', 'date', 'series', 'court',
+          'surface', 'round', 'best_of', 'winner', 'loser', 'wrank', 'lrank',
+          'wpoints', 'lpoints', 'w1', 'l1', 'w2', 'l2', 'w3', 'l3', 'w4', 'l4',
+          'w5', 'l5', 'wsets', 'lsets', 'comment', 'b365w', 'b365l', 'exw',
+          'exl', 'lbw', 'lbl', 'psw', 'psl', 'sjw', 'sjl', 'maxw', 'maxl',
+          'avgw', 'avgl')
+
+# A row has the fields and the odds of every bookmaker with both of its
+# columns in the datasource, as a name -> (winner odd, loser odd) dict
+Row = namedtuple('Row', FIELDS + ('odds',))
+
+# The layout of a datasource is recognized by its marker header, the
+# aliases map its headers to the fields. The headers are compared in lower
+# case without spaces.
+Layout = namedtuple('Layout', ('name', 'marker', 'aliases'))
+
+# The headers named differently from the fields in every layout
+COMMON_ALIASES = {
+    'bestof': 'best_of',
+    'wpts': 'wpoints',
+    'lpts': 'lpoints',
+}
+
+# The known layouts in the order they are tried
+LAYOUTS = []
+
+# The fields without which a row can't be imported, the other columns can
+# be missing from a datasource
+REQUIRED_FIELDS = frozenset(('tournament', 'date', 'surface', 'round',
+                             'winner', 'loser'))
+
+INTEGER_FIELDS = frozenset(('atp', 'best_of', 'wrank', 'lrank',
+                            'wpoints', 'lpoints'))
+GAMES_FIELDS = frozenset(FIELDS[FIELDS.index('w1'):FIELDS.index('lsets') + 1])
+ODDS_FIELDS = frozenset(FIELDS[FIELDS.index('b365w'):])
+# The prefixes of the odds columns aggregating the bookmakers
+AGGREGATE_PREFIXES = ('max', 'avg')
+SET_FIELDS = tuple(('w%s' % i, 'l%s' % i) for i in xrange(1, 6))
+
+CSV_ENCODING = 'cp1252'
+CSV_DATE_FORMATS = ('%d/%m/%Y', '%Y-%m-%d', '%m/%d/%Y')
+
+# The parsed datasource: the name of its layout, the valid Rows and the
+# RejectedRows
+Table = namedtuple('Table', ('layout', 'rows', 'rejected'))
+
+# A malformed row with its number in the datasource (the header is the 1st),
+# the reason and its raw values by field
+RejectedRow = namedtuple('RejectedRow', ('number', 'reason', 'values'))
+
+
+class LayoutError(ValueError):
+    """ The datasource can't be imported at all. """
+
+
+def register_layout(name, marker, aliases=None):
+    """ Registers a layout, recognized if the marker header is present. """
+
+    layout_aliases = dict(COMMON_ALIASES)
+    layout_aliases.update(aliases or {})
+    LAYOUTS.append(Layout(name, marker, layout_aliases))
+
+
+register_layout('atp', 'atp')
+register_layout('wta', 'wta', {'wta': 'atp', 'tier': 'series'})
+
+
+def normalize_header(header):
+    """ The header in the form it's compared in. """
+
+    return unicode(header).strip().lower().replace(' ', '')
+
+
+def detect_layout(headers):
+    """ Returns the layout of the header row, the field -> column index map
+    and the bookmaker -> (winner column index, loser column index) map.
+
+    Every <prefix>w, <prefix>l header pair but the aggregates is a
+    bookmaker, including the ones without fields. Raises LayoutError if
+    the layout isn't known or a required column is missing. The other
+    unknown columns are ignored.
+    """
+
+    headers = [normalize_header(header) for header in headers]
+    for layout in LAYOUTS:
+        if layout.marker in headers:
+            break
+    else:
+        raise LayoutError("Unknown layout, none of the %s headers is present"
+                          % ', '.join(layout.marker for layout in LAYOUTS))
+    columns = {}
+    for index, header in enumerate(headers):
+        field = layout.aliases.get(header, header)
+        if field in FIELDS and field not in columns:
+            columns[field] = index
+    bookmakers = {}
+    for index, header in enumerate(headers):
+        prefix = header[:-1]
+        if (header.endswith('w') and prefix and prefix not in bookmakers and
+                prefix not in AGGREGATE_PREFIXES and prefix + 'l' in headers):
+            bookmakers[prefix] = (index, headers.index(prefix + 'l'))
+    missing = REQUIRED_FIELDS.difference(columns)
+    if missing:
+        raise LayoutError("The %s layout misses the %s columns"
+                          % (layout.name, ', '.join(sorted(missing))))
+    return layout, columns, bookmakers
+
+
+def int_column(values, default, strict):
+    """ Converts a column of numbers, default replaces the missing ones.
+
+    Returns the values and the indexes of the invalid ones, which are also
+    replaced by default. If not strict no value is invalid.
+    """
+
+    ret = []
+    invalid = []
+    for index, value in enumerate(values):
+        if isinstance(value, float):
+            ret.append(int(value))
+            continue
+        try:
+            ret.append(int(float(value)))
+        except (ValueError, OverflowError):
+            ret.append(default)
+            if strict and unicode(value).strip():
+                invalid.append(index)
+    return ret, invalid
+
+
+def float_column(values):
+    """ Converts a column of real numbers, None replaces the missing or
+    invalid ones.
+    """
+
+    ret = []
+    for value in values:
+        if isinstance(value, float):
+            ret.append(value)
+        else:
+            try:
+                ret.append(float(value))
+            except ValueError:
+                ret.append(None)
+    return ret, []
+
+
+def text_column(values, required):
+    """ Converts a column to unicode, the whole numbers without fraction.
+
+    The empty values of a required column are invalid.
+    """
+
+    ret = [unicode(int(value)) if isinstance(value, float) and value.is_integer()
+           else unicode(value) for value in values]
+    invalid = [index for index, value in enumerate(ret)
+               if required and not value.strip()]
+    return ret, invalid
+
+
+def parse_date(value, datemode):
+    """ The date of an Excel serial date or of a date string, None if invalid. """
+
+    if isinstance(value, float):
+        try:
+            return datetime.date(*xldate_as_tuple(value, datemode)[:3])
+        except (ValueError, XLDateError):
+            return None
+    for date_format in CSV_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(unicode(value).strip(),
+                                              date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def date_column(values, datemode):
+    """ Converts a column of Excel serial dates or date strings to dates. """
+
+    ret = [parse_date(value, datemode) for value in values]
+    return ret, [index for index, value in enumerate(ret) if value is None]
+
+
+def convert_column(field, values, datemode):
+    """ Converts the raw values of the column of a field.
+
+    Returns the values and the indexes of the invalid ones.
+    """
+
+    if field in INTEGER_FIELDS:
+        return int_column(values, 0, False)
+    if field in GAMES_FIELDS:
+        return int_column(values, None, True)
+    if field in ODDS_FIELDS:
+        return float_column(values)
+    if field == 'date':
+        return date_column(values, datemode)
+    return text_column(values, field in REQUIRED_FIELDS)
+
+
+def check_row(row):
+    """ The reason why a converted row is malformed or None if it's valid. """
+
+    if row.winner == row.loser:
+        return "The winner and the loser are the same player"
+    for i, (winner_field, loser_field) in enumerate(SET_FIELDS, 1):
+        if (getattr(row, winner_field) is None) != (getattr(row, loser_field) is None):
+            return "The score of set %s is incomplete" % i
+    return None
+
+
+def build_table(headers, get_column, row_count, datemode=0):
+    """ Converts the columns of a table to a Table.
+
+    get_column returns the raw values of a column by its index. Every
+    column is converted and validated in one pass, the columns missing from
+    the datasource are filled with missing values. The odds of every
+    bookmaker are collected in the odds dicts of the rows. The malformed
+    rows are rejected.
+    """
+
+    layout, columns, bookmakers = detect_layout(headers)
+    raw = {}
+    converted = []
+    reasons = {}
+    for field in FIELDS:
+        if field in columns:
+            values = raw[field] = get_column(columns[field])
+        else:
+            values = [u''] * row_count
+        values, invalid = convert_column(field, values, datemode)
+        for index in invalid:
+            reasons.setdefault(index, "Invalid %s: %r" % (field, raw[field][index]))
+        converted.append(values)
+    odds = [{} for index in xrange(row_count)]
+    for name, indexes in bookmakers.iteritems():
+        sides = []
+        for side, column_index in zip('wl', indexes):
+            if name + side not in raw:
+                raw[name + side] = get_column(column_index)
+            sides.append(float_column(raw[name + side])[0])
+        for index, pair in enumerate(izip(*sides)):
+            if None not in pair:
+                odds[index][name] = pair
+    rows = []
+    rejected = []
+    for index, values in enumerate(izip(*converted)):
+        row = Row._make(values + (odds[index],))
+        reason = reasons.get(index) or check_row(row)
+        if reason is None:
+            rows.append(row)
+        else:
+            rejected.append(RejectedRow(index + 2, reason, dict(
+                (field, column[index]) for field, column in raw.iteritems())))
+    return Table(layout.name, rows, rejected)
+
+
+def read_xls(file_name, sheet_name):
+    """ Reads a sheet of an Excel workbook column by column. """
+
+    workbook = open_workbook(file_name)
+    try:
+        sheet = workbook.sheet_by_name(sheet_name)
+        if not sheet.nrows:
+            raise LayoutError("The %s sheet is empty" % sheet_name)
+        return build_table(sheet.row_values(0),
+                           lambda index: sheet.col_values(index, start_rowx=1),
+                           sheet.nrows - 1, workbook.datemode)
+    finally:
+        workbook.release_resources()
+
+
+def read_csv(file_name):
+    """ Reads a CSV file. """
+
+    with open(file_name, 'rb') as csv_file:
+        lines = [[cell.decode(CSV_ENCODING, 'replace') for cell in line]
+                 for line in csv.reader(csv_file) if line]
+    if not lines:
+        raise LayoutError("The CSV file is empty")
+    headers, lines = lines[0], lines[1:]
+    width = len(headers)
+    lines = [line[:width] + [u''] * (width - len(line)) for line in lines]
+    table = zip(*lines) if lines else [()] * width
+    return build_table(headers, lambda index: list(table[index]), len(lines))
+
+
+def read_table(file_name, sheet_name):
+    """ Reads a CSV file or a sheet of an Excel workbook. """
+
+    if os.path.splitext(file_name)[1].lower() == '.csv':
+        return read_csv(file_name)
+    return read_xls(file_name, sheet_name)
@@ -0,0 +1,128 @@
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from json import dumps
+from django.db import connection, transaction
+from django.utils import timezone
+from tennis_data.models import ImportRun, QuarantinedRow, Job
+
+logger = logging.getLogger('tennis_data.imports')
+
+
+class ImportProgress(object):
+    """ Collects the per stage timings and query counts of an import.
+
+    The stages are measured with the stage context manager, the queries
+    through the debug cursor of the connection. The captured queries are
+    dropped at the end of every stage, so a long import doesn't accumulate
+    them even with DEBUG. Only the database work of the writer process is
+    stored, the progress can be pickled to carry the timings of a parsing
+    process over to it.
+
+    The progress of an import run by a job is reported in the Job row.
+    """
+
+    def __init__(self, source, job_id=None):
+        self.source = source
+        self.job_id = job_id
+        self.started = timezone.now()
+        self.start_time = time.time()
+        self.stages = OrderedDict()
+        self.layout = ''
+        self.rows = 0
+        self.imported = 0
+        self.rejected = []
+
+    @contextmanager
+    def stage(self, name):
+        """ Adds the time and the queries of the block to the named stage. """
+
+        debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        first_query = len(connection.queries)
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            queries = len(connection.queries) - first_query
+            del connection.queries[first_query:]
+            connection.use_debug_cursor = debug_cursor
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'queries': 0})
+            stage['seconds'] += seconds
+            stage['queries'] += queries
+
+    @contextmanager
+    def running(self):
+        """ Stores the import when the block ends, as failed if it raises.
+
+        A failed database query aborts the transaction on PostgreSQL, it's
+        rolled back before the import is stored.
+        """
+
+        try:
+            yield self
+        except Exception, e:
+            transaction.rollback()
+            self.finish(u'%s: %s' % (e.__class__.__name__, e))
+            raise
+        self.finish()
+
+    def reject(self, rejected):
+        """ Quarantines the malformed rows, logging the reasons. """
+
+        for row in rejected:
+            logger.warning("%s: row %s rejected: %s", self.source,
+                           row.number, row.reason)
+        self.rejected.extend(rejected)
+
+    def elapsed(self):
+        """ The seconds since the start of the import. """
+
+        return time.time() - self.start_time
+
+    def report(self, imported, total):
+        """ Logs the number of the imported rows and the throughput. """
+
+        self.imported = imported
+        logger.info("%s: %s/%s rows imported, %.0f rows/s", self.source,
+                    imported, total, imported / max(self.elapsed(), 1e-6))
+        if self.job_id is not None:
+            Job.objects.filter(pk=self.job_id).update(done=imported, total=total)
+
+    def finish(self, error=None):
+        """ Stores the import as an ImportRun with its quarantined rows and
+        logs its stages.
+        """
+
+        seconds = self.elapsed()
+        status = ImportRun.FAILED if error is not None else ImportRun.FINISHED
+        logger.info("%s: %s, %s rows parsed, %s rejected, %s imported in %.2f s (%s)",
+                    self.source, status, self.rows, len(self.rejected),
+                    self.imported, seconds,
+                    ', '.join('%s %.2f s/%s queries'
+                              % (name, stage['seconds'], stage['queries'])
+                              for name, stage in self.stages.iteritems()))
+        run = ImportRun.objects.create(
+            source=self.source,
+            layout=self.layout,
+            started=self.started,
+            finished=timezone.now(),
+            status=status,
+            rows=self.rows,
+            rejected=len(self.rejected),
+            imported=self.imported,
+            seconds=seconds,
+            queries=sum(stage['queries'] for stage in self.stages.itervalues()),
+            stages=dumps(self.stages),
+            error=error or ''
+        )
+        QuarantinedRow.objects.bulk_create([
+            QuarantinedRow(run=run, number=row.number, reason=row.reason[:255],
+                           values=dumps(row.values, default=unicode))
+            for row in self.rejected
+        ])
+        if self.job_id is not None:
+            Job.objects.filter(pk=self.job_id).update(import_run=run)
+        return run
@@ -0,0 +1,116 @@
+import numpy as np
+from django.db import transaction
+from tennis_data.models import Match, RatingSnapshot, PlayerRating
+from tennis_data.settings import IMPORT_BATCH_SIZE
+from tennis_data.utils import chunked
+
+INITIAL_RATING = 1500.0
+
+# The overall rating is stored with an empty surface
+OVERALL = ''
+
+
+def k_factor(matches):
+    """ The K factor of a player after the given number of matches.
+
+    New players move faster, the factor decays with their match count.
+    """
+
+    return 250.0 / (matches + 5) ** 0.4
+
+
+def load_matches():
+    """ Loads the match history into arrays sorted chronologically.
+
+    Returns the match ids, the dense winner and loser indexes, the player
+    ids of the indexes, the dense surface indexes and the surfaces.
+    """
+
+    match_data = Match.objects.values_list('id', 'date', 'winner', 'loser',
+                                           'tournament__surface')
+    ids, dates, winners, losers, surfaces = (list(column) for column in
+                                             zip(*match_data) or [[]] * 5)
+    ids = np.array(ids, dtype=np.int64)
+    dates = np.array([date.toordinal() for date in dates], dtype=np.int64)
+    order = np.lexsort((ids, dates))
+    player_ids, player_indexes = np.unique(
+        np.concatenate([np.array(winners, dtype=np.int64),
+                        np.array(losers, dtype=np.int64)]),
+        return_inverse=True)
+    surface_names, surface_indexes = np.unique(np.array(surfaces, dtype=object),
+                                               return_inverse=True)
+    count = len(ids)
+    return (ids[order], player_indexes[:count][order],
+            player_indexes[count:][order], player_ids,
+            surface_indexes[order], surface_names)
+
+
+def compute(winners, losers, surfaces, player_count, surface_count):
+    """ Computes the overall and the per surface Elo ratings in one pass.
+
+    The arguments are the chronologically sorted dense indexes. Returns the
+    pre-match overall and surface ratings of the winners and losers, and
+    the final ratings and match counts, overall and by surface.
+    """
+
+    rating = [INITIAL_RATING] * player_count
+    played = [0] * player_count
+    surface_rating = [[INITIAL_RATING] * player_count
+                      for _ in xrange(surface_count)]
+    surface_played = [[0] * player_count for _ in xrange(surface_count)]
+    count = len(winners)
+    pre_match = np.empty((4, count))
+    for i, (winner, loser, surface) in enumerate(zip(winners.tolist(),
+                                                     losers.tolist(),
+                                                     surfaces.tolist())):
+        current_rating = surface_rating[surface]
+        current_played = surface_played[surface]
+        pre_match[:, i] = (rating[winner], rating[loser],
+                           current_rating[winner], current_rating[loser])
+        for ratings, counts in ((rating, played),
+                                (current_rating, current_played)):
+            expected = 1.0 / (1.0 + 10 ** ((ratings[loser] - ratings[winner]) / 400.0))
+            ratings[winner] += k_factor(counts[winner]) * (1.0 - expected)
+            ratings[loser] -= k_factor(counts[loser]) * (1.0 - expected)
+            counts[winner] += 1
+            counts[loser] += 1
+    return (pre_match, np.array(rating), np.array(played),
+            np.array(surface_rating), np.array(surface_played))
+
+
+def recompute():
+    """ Recomputes the ratings from the whole match history and stores them. """
+
+    ids, winners, losers, player_ids, surfaces, surface_names = load_matches()
+    pre_match, rating, played, surface_rating, surface_played = compute(
+        winners, losers, surfaces, len(player_ids), len(surface_names))
+
+    player_ratings = [
+        PlayerRating(player_id=player_id, surface=OVERALL,
+                     rating=player_rating, matches=matches)
+        for player_id, player_rating, matches in
+        zip(player_ids.tolist(), rating.tolist(), played.tolist())
+    ]
+    for surface, ratings, counts in zip(surface_names.tolist(),
+                                        surface_rating.tolist(),
+                                        surface_played.tolist()):
+        player_ratings.extend(
+            PlayerRating(player_id=player_id, surface=surface,
+                         rating=player_rating, matches=matches)
+            for player_id, player_rating, matches in
+            zip(player_ids.tolist(), ratings, counts)
+            if matches)
+    snapshots = [
+        RatingSnapshot(match_id=match_id, winner_rating=values[0],
+                       loser_rating=values[1], winner_surface_rating=values[2],
+                       loser_surface_rating=values[3])
+        for match_id, values in zip(ids.tolist(), pre_match.T.tolist())
+    ]
+    with transaction.commit_on_success():
+        RatingSnapshot.objects.all().delete()
+        PlayerRating.objects.all().delete()
+        for model, objects in ((RatingSnapshot, snapshots),
+                               (PlayerRating, player_ratings)):
+            for batch in chunked(objects, IMPORT_BATCH_SIZE):
+                model.objects.bulk_create(batch)
+    return len(snapshots)
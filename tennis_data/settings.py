@@ -80,6 +80,21 @@ STATICFILES_FINDERS = (
 #    'django.contrib.staticfiles.finders.DefaultStorageFinder',
 )
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The encoded API responses, every process caches its own. They are
+    # keyed by the data generation shared through the database.
+    'api': {
+        'BACKEND': 'tennis_data.cache.LRUMemoryCache',
+        'LOCATION': 'api',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000
+        }
+    }
+}
+
 # Make this unique, and don't share it with anybody.
 SECRET_KEY = 'rjp1#j-xf5l#mw@(bg+dkchys@d_b!w5))as*pwvqdjzuc4y-&'
 
@@ -96,6 +111,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'tennis_data.middleware.InstrumentationMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
@@ -142,6 +158,10 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler'
         }
     },
     'loggers': {
@@ -150,8 +170,89 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'tennis_data': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     }
 }
 
 # Settings related to the project
 EPS = 0.00001
+
+# The number of rows inserted by one bulk_create call of the bulk importer
+IMPORT_BATCH_SIZE = 1000
+
+# The number of matches whose odds are recomputed by one UPDATE, keeping
+# the number of parameters below the limit of SQLite
+ODDS_REFRESH_BATCH_SIZE = 500
+
+# The directory where the downloaded archives are kept for offline imports,
+# None means they are downloaded to temporary files on every import
+IMPORT_CACHE_DIR = None
+
+# The seconds a download of a datasource may stall before it fails
+IMPORT_DOWNLOAD_TIMEOUT = 60
+
+# The default and the maximal number of items on a page of the list endpoints
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+# The maximal number of ids requested at once from the batch endpoints
+API_MAX_BATCH_SIZE = 500
+
+# The number of rows fetched by one query of the streaming exports
+API_EXPORT_CHUNK_SIZE = 2000
+
+# The directory of the columnar exports, None means a directory in the
+# system's temporary directory
+EXPORT_ROOT = None
+
+# The seconds the clients are asked to wait for an export being built
+API_EXPORT_RETRY_AFTER = 30
+
+# The cache of the API responses and their timeouts in seconds, the cached
+# responses are invalidated by the imports anyway
+API_CACHE = 'api'
+API_LIST_CACHE_TIMEOUT = 60 * 60
+API_DETAIL_CACHE_TIMEOUT = 24 * 60 * 60
+
+# How often in seconds a process checks the database for a new data
+# generation, the longest a process serves the data of the previous one
+API_GENERATION_CHECK_INTERVAL = 1
+
+# How long the clients may use a response without revalidating it
+API_CLIENT_MAX_AGE = 0
+
+# The fraction of the API requests whose queries are captured by the
+# instrumentation middleware, every request is sampled with DEBUG
+API_METRICS_SAMPLE_RATE = 0.01
+
+# The number of the latest measurements per view the percentiles of
+# /api/_metrics are computed from
+API_METRICS_WINDOW = 1000
+
+# The API requests slower than this many milliseconds are logged with their
+# queries if they were sampled, None disables the log
+API_SLOW_REQUEST_MS = None
+
+# The number of jobs run at once by the run_workers command, and the limits
+# of the job groups (see jobs.TASKS), the groups not listed run one job at
+# a time
+JOB_CONCURRENCY = 2
+JOB_GROUP_CONCURRENCY = {'writes': 1, 'ratings': 1}
+
+# How many times a job is tried and the delay before the first retry in
+# seconds, doubled after every failure
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 60
+
+# How often the idle workers look for new jobs in seconds
+JOB_POLL_INTERVAL = 2
+
+# How often in seconds the workers mark their running jobs alive, and how
+# long a running job may go unmarked before it's taken for the job of a
+# dead worker and queued again
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_LEASE_TIMEOUT = 5 * 60
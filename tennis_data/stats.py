@@ -0,0 +1,100 @@
+from collections import defaultdict
+from django.db import transaction
+from tennis_data.models import Match, Set, PlayerStats
+from tennis_data.settings import IMPORT_BATCH_SIZE
+from tennis_data.utils import chunked
+
+COUNTERS = ('wins', 'losses', 'sets_won', 'sets_lost',
+            'games_won', 'games_lost', 'tiebreaks_won', 'tiebreaks_lost')
+
+
+def new_deltas():
+    """ A (player id, season, surface) -> counter values map. """
+
+    return defaultdict(lambda: [0] * len(COUNTERS))
+
+
+def add_match(deltas, winner_id, loser_id, date, surface, sets, sign=1):
+    """ Adds the counters of a match to the deltas, sign=-1 removes them. """
+
+    winner = deltas[(winner_id, date.year, surface)]
+    loser = deltas[(loser_id, date.year, surface)]
+    winner[0] += sign
+    loser[1] += sign
+    for winner_games, loser_games in sets:
+        winner_games, loser_games = int(winner_games), int(loser_games)
+        won = 1 if winner_games > loser_games else 0
+        tiebreak = 1 if set([winner_games, loser_games]) == set([7, 6]) else 0
+        winner[2] += sign * won
+        winner[3] += sign * (1 - won)
+        loser[2] += sign * (1 - won)
+        loser[3] += sign * won
+        winner[4] += sign * winner_games
+        winner[5] += sign * loser_games
+        loser[4] += sign * loser_games
+        loser[5] += sign * winner_games
+        winner[6] += sign * tiebreak * won
+        winner[7] += sign * tiebreak * (1 - won)
+        loser[6] += sign * tiebreak * (1 - won)
+        loser[7] += sign * tiebreak * won
+
+
+def add_stored_matches(deltas, match_ids, sign=1):
+    """ Adds the counters of the already stored matches to the deltas. """
+
+    for ids_chunk in chunked(list(match_ids), IMPORT_BATCH_SIZE):
+        sets = defaultdict(list)
+        set_data = Set.objects.filter(match__in=ids_chunk) \
+                              .values_list('match', 'winner_games', 'loser_games')
+        for match_id, winner_games, loser_games in set_data:
+            sets[match_id].append((winner_games, loser_games))
+        match_data = Match.objects.filter(pk__in=ids_chunk) \
+                                  .values_list('id', 'winner', 'loser', 'date',
+                                               'tournament__surface')
+        for match_id, winner_id, loser_id, date, surface in match_data:
+            add_match(deltas, winner_id, loser_id, date, surface,
+                      sets[match_id], sign)
+
+
+def apply_deltas(deltas):
+    """ Adds the deltas to the stored statistics.
+
+    The affected rows are read, deleted and inserted again with the new
+    values, which takes a fixed number of queries whatever the number of
+    keys.
+    """
+
+    deltas = dict((key, values) for key, values in deltas.iteritems()
+                  if any(values))
+    if not deltas:
+        return
+    totals = dict((key, list(values)) for key, values in deltas.iteritems())
+    stored_ids = []
+    for players_chunk in chunked(sorted(set(key[0] for key in deltas)),
+                                 IMPORT_BATCH_SIZE):
+        stored = PlayerStats.objects.filter(player__in=players_chunk) \
+                                    .values_list('id', 'player', 'season',
+                                                 'surface', *COUNTERS)
+        for row in stored:
+            key = tuple(row[1:4])
+            if key in totals:
+                stored_ids.append(row[0])
+                totals[key] = [total + value
+                               for total, value in zip(totals[key], row[4:])]
+    for ids_chunk in chunked(stored_ids, IMPORT_BATCH_SIZE):
+        PlayerStats.objects.filter(pk__in=ids_chunk).delete()
+    PlayerStats.objects.bulk_create([
+        PlayerStats(player_id=key[0], season=key[1], surface=key[2],
+                    **dict(zip(COUNTERS, values)))
+        for key, values in totals.iteritems()
+    ])
+
+
+def rebuild():
+    """ Recomputes every statistics from the stored matches. """
+
+    with transaction.commit_on_success():
+        PlayerStats.objects.all().delete()
+        deltas = new_deltas()
+        add_stored_matches(deltas, Match.objects.values_list('id', flat=True))
+        apply_deltas(deltas)
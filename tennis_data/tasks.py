@@ -1,100 +1,132 @@
+from django.db import transaction
+from django.db.models import Max
 from tennis_data.models import (Tournament, Player,
                                 Ranking, Match, Set,
-                                Odds, DEFAULT_ODD)
+                                Odds, ImportedRow, Bookmaker,
+                                BookmakerOdds)
+from tennis_data.settings import (IMPORT_BATCH_SIZE, IMPORT_CACHE_DIR,
+                                  IMPORT_DOWNLOAD_TIMEOUT)
+from tennis_data.utils import chunked
+from tennis_data.cache import bump_data_generation
+from tennis_data.progress import ImportProgress
+from tennis_data import stats
+from tennis_data.parsing import FIELDS, SET_FIELDS, read_table
+import os
 import urllib2
+import urlparse
 import tempfile
-from zipfile import ZipFile
-from xlrd import open_workbook, xldate_as_tuple
+from contextlib import closing
+from shutil import copyfileobj
+from zipfile import ZipFile, is_zipfile
 import datetime
+from collections import OrderedDict
+from hashlib import sha1
+from itertools import izip
 
-CELL_MAP = {
-    "atp": 0,
-    "location": 1,
-    "tournament": 2,
-    "date": 3,
-    "series": 4,
-    "court": 5,
-    "surface": 6,
-    "round": 7,
-    "best_of": 8,
-    "winner": 9,
-    "loser": 10,
-    "wrank": 11,
-    "lrank": 12,
-    "wpoints": 13,
-    "lpoints": 14,
-    "w1": 15,
-    "l1": 16,
-    "w2": 17,
-    "l2": 18,
-    "w3": 19,
-    "l3": 20,
-    "w4": 21,
-    "l4": 22,
-    "w5": 23,
-    "l5": 24,
-    "wsets": 25,
-    "lsets": 26,
-    "comment": 27,
-    "b365w": 28,
-    "b365l": 29,
-    "exw": 30,
-    "exl": 31,
-    "lbw": 32,
-    "lbl": 33,
-    "psw": 34,
-    "psl": 35,
-    "sjw": 36,
-    "sjl": 37,
-    "maxw": 38,
-    "maxl": 39,
-    "avgw": 40,
-    "avgl": 41
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# The extensions of the workbooks and the CSV files, the members of a zipped
+# datasource are looked up by them
+DATASOURCE_EXTENSIONS = ('.xls', '.xlsx', '.csv')
+
+# The serial number of the dates in the 1900 based Excel workbooks
+XLDATE_EPOCH = datetime.date(1899, 12, 30)
+
+TOURNAMENT_FIELDS = ('atp_number', 'name', 'location', 'series',
+                     'court', 'surface', 'best_of')
+
+SEASON_URLS = {
+    'atp': "http://tennis-data.co.uk/%(year)s/%(year)s.zip",
+    'wta': "http://tennis-data.co.uk/%(year)sw/%(year)s.zip"
 }
 
-def int_or_zero(possibly_integer):
-    try:
-        ret = int(possibly_integer)
-    except ValueError:
-        ret = 0
-    return ret
+def season_source(year, tour):
+    """ The (file url, sheet name) pair of a season of a tour. """
+
+    return SEASON_URLS[tour] % {'year': year}, str(year)
+
+def parse_season(source):
+    """ Parses a season in a worker process without touching the database.
 
-def float_or_value(possibly_float, value):
+    The source holds the arguments of BulkPopulateDatabase. Returns a
+    (source, records, progress, error) tuple so a failing season doesn't
+    stop the others.
+    """
+
+    importer = BulkPopulateDatabase(*source, autorun=False)
     try:
-        ret = float(possibly_float)
-    except ValueError:
-        ret = value
-    return ret
+        records = importer.parse()
+    except Exception, e:
+        return source, None, importer.progress, u'%s: %s' % (e.__class__.__name__, e)
+    return source, records, importer.progress, None
 
 class PopulateDatabase(object):
-    """ This class is responsible for populating the database with the initial data. """
+    """ This class is responsible for populating the database with the initial data.
+
+    The rows are recorded in the ImportedRow ledger. The rows already in
+    the ledger and the repeated rows of the datasource are skipped, so the
+    changed rows of an already imported season aren't updated, use
+    BulkPopulateDatabase to refresh it.
+    """
 
     file_url = "http://tennis-data.co.uk/2011/2011.zip"
     sheet_name = "2011"
+    cache_dir = IMPORT_CACHE_DIR
+
+    def __init__(self, file_url=None, sheet_name=None, cache_dir=None,
+                 job_id=None):
+        """ Populates the database from the datasource.
 
-    def __init__(self):
-        """ Populates the database from the datasource. """
+        The progress is reported to the job if a job_id is given.
+        """
 
-        self.workbook = self.create_xls_obj()
-        for row in self.iterate_rows(self.workbook):
-            self.create_tournament(row)
-            self.create_players(row)
-            self.create_rankings(row)
-            self.create_match(row)
-            self.create_sets(row)
-            self.create_odds(row)
+        self.file_url = file_url or self.file_url
+        self.sheet_name = sheet_name or self.sheet_name
+        self.cache_dir = cache_dir or self.cache_dir
+        self.progress = ImportProgress(self.file_url, job_id)
+        with self.progress.running():
+            self.rows = self.read_rows()
+            with self.progress.stage('select'):
+                rows = self.select_new(self.rows)
+            row_stages = (('tournaments', self.create_tournament),
+                          ('players', self.create_players),
+                          ('rankings', self.create_rankings),
+                          ('matches', self.create_match),
+                          ('sets', self.create_sets),
+                          ('odds', self.create_odds),
+                          ('stats', self.create_stats))
+            for i, row in enumerate(rows, 1):
+                for stage_name, create in row_stages:
+                    with self.progress.stage(stage_name):
+                        create(row)
+                if i % IMPORT_BATCH_SIZE == 0:
+                    self.progress.report(i, len(rows))
+            self.progress.report(len(rows), len(rows))
+            bump_data_generation()
+
+    def select_new(self, rows):
+        """ Drops the rows which are in the ledger and the repeated ones. """
+
+        unique = OrderedDict()
+        for row in rows:
+            unique.setdefault(self.row_key(row), row)
+        recorded = set()
+        for keys_chunk in chunked(unique.keys(), IMPORT_BATCH_SIZE):
+            recorded.update(ImportedRow.objects.filter(key__in=keys_chunk)
+                                               .values_list('key', flat=True))
+        return [row for key, row in unique.iteritems() if key not in recorded]
 
     def get_tournament_params(self, row):
         """ Extracting the tournament data from the row. """
 
         return {
-            'atp_number': int_or_zero(row[CELL_MAP['atp']].value),
-            'name': row[CELL_MAP['tournament']].value,
-            'location': row[CELL_MAP['location']].value,
-            'series': row[CELL_MAP['series']].value,
-            'court': row[CELL_MAP['court']].value,
-            'surface': row[CELL_MAP['surface']].value,
-            'best_of': int_or_zero(row[CELL_MAP['best_of']].value)
+            'atp_number': row.atp,
+            'name': row.tournament,
+            'location': row.location,
+            'series': row.series,
+            'court': row.court,
+            'surface': row.surface,
+            'best_of': row.best_of
         }
 
     def create_tournament(self, row):
@@ -106,8 +138,8 @@ class PopulateDatabase(object):
     def create_players(self, row):
         """ Creating the loser and the winner player if they haven't existed before. """
 
-        Player.objects.get_or_create(name=row[CELL_MAP["winner"]].value)
-        Player.objects.get_or_create(name=row[CELL_MAP["loser"]].value)
+        Player.objects.get_or_create(name=row.winner)
+        Player.objects.get_or_create(name=row.loser)
 
     def create_rankings(self, row):
         """ Creating the ranking for the winner and loser players. """
@@ -115,110 +147,564 @@ class PopulateDatabase(object):
         tournament_params = self.get_tournament_params(row)
         tournament = Tournament.objects.get(**tournament_params)
         for player_type, rank_name in (("winner", "wrank"), ("loser", "lrank")):
-            player = Player.objects.get(name=row[CELL_MAP[player_type]].value)
-            rank = int_or_zero(row[CELL_MAP[rank_name]].value)
+            player = Player.objects.get(name=getattr(row, player_type))
+            rank = getattr(row, rank_name)
             Ranking.objects.get_or_create(player=player,
                                           tournament=tournament,
                                           rank=rank)
 
+    def get_match_fields(self, row):
+        """ Extracts the fields of the match which aren't foreign keys. """
+
+        return {
+            "date": row.date,
+            "round": row.round,
+            "winner_points": row.wpoints,
+            "loser_points": row.lpoints,
+            "status": row.comment
+        }
+
     def get_match_params(self, row):
         """ Extracts the params related to the match from the row. """
 
-        winner = Player.objects.get(name=row[CELL_MAP["winner"]].value)
-        loser = Player.objects.get(name=row[CELL_MAP["loser"]].value)
+        match_params = self.get_match_fields(row)
+        match_params["winner"] = Player.objects.get(name=row.winner)
+        match_params["loser"] = Player.objects.get(name=row.loser)
         tournament_params = self.get_tournament_params(row)
-        tournament = Tournament.objects.get(**tournament_params)
-        date_tuple = xldate_as_tuple(row[CELL_MAP['date']].value,
-                                     self.workbook.datemode)
-        date = datetime.date(*date_tuple[:3])
-        return {
-            "winner": winner,
-            "loser": loser,
-            "tournament": tournament,
-            "date": date,
-            "round": row[CELL_MAP["round"]].value,
-            "winner_points": int_or_zero(row[CELL_MAP["wpoints"]].value),
-            "loser_points": int_or_zero(row[CELL_MAP["lpoints"]].value),
-            "status": row[CELL_MAP["comment"]].value
-        }
+        match_params["tournament"] = Tournament.objects.get(**tournament_params)
+        return match_params
 
 
     def create_match(self, row):
-        """ Creates a match from the raw data. """
+        """ Creates a match from the raw data and records its row in the
+        ImportedRow ledger.
+        """
 
         match_params = self.get_match_params(row)
-        match = Match(**match_params)
-        match.save()
+        with transaction.commit_on_success():
+            match = Match(**match_params)
+            match.save()
+            ImportedRow(key=self.row_key(row),
+                        fingerprint=self.row_fingerprint(row),
+                        match=match).save()
+
+    def row_key(self, row):
+        """ A hash identifying the match of the row across imports.
+
+        The number and the date are hashed as the Excel cells hold them, so
+        the keys of the rows imported from the workbooks stay the same
+        whatever the format of the datasource.
+        """
+
+        return self.match_row_key(row.atp, row.tournament, row.date,
+                                  row.winner, row.loser, row.round)
+
+    @staticmethod
+    def match_row_key(atp_number, tournament, date, winner, loser, round):
+        """ The row key of a match from its natural key. """
+
+        values = (float(atp_number), tournament,
+                  float((date - XLDATE_EPOCH).days), winner, loser, round)
+        return sha1(repr(values)).hexdigest()
+
+    def row_fingerprint(self, row):
+        """ A hash of every field of the row, changes when any of them does.
+
+        The odds of the bookmakers without fields are hashed only if there
+        are any, so the fingerprints of the other rows stay the same.
+        """
+
+        values = tuple(row[:len(FIELDS)])
+        extra_odds = sorted((name, pair) for name, pair in row.odds.iteritems()
+                            if name + 'w' not in FIELDS)
+        if extra_odds:
+            values += (tuple(extra_odds),)
+        return sha1(repr(values)).hexdigest()
+
+    def get_set_scores(self, row):
+        """ Extracts the (winner games, loser games) pairs of the played sets. """
+
+        scores = []
+        for winner_column, loser_column in SET_FIELDS:
+            winner_games = getattr(row, winner_column)
+            loser_games = getattr(row, loser_column)
+            if winner_games is None or loser_games is None:
+                break
+            scores.append((winner_games, loser_games))
+        return scores
 
     def create_sets(self, row):
         """ Creates the sets related to the match. """
 
         match_params = self.get_match_params(row)
         match = Match.objects.get(**match_params)
-        prefixes = ["w", "l"]
-        for i in xrange(1,6):
-            set_pair = []
-            for prefix in prefixes:
-                cell_value = row[CELL_MAP[prefix + str(i)]].value
-                if cell_value != '':
-                    set_pair.append(cell_value)
-            if set_pair == []:
-                break
-            else:
-                current_set = Set(match=match,
-                                  set_number=i,
-                                  winner_games=set_pair[0],
-                                  loser_games=set_pair[1])
-                current_set.save()
+        for i, (winner_games, loser_games) in enumerate(self.get_set_scores(row)):
+            current_set = Set(match=match,
+                              set_number=i + 1,
+                              winner_games=winner_games,
+                              loser_games=loser_games)
+            current_set.save()
+
+    def get_odds_params(self, row):
+        """ Extracts the (winner, loser) odds of the various companies from the row.
+
+        The companies without odds in the row are left out.
+        """
+
+        return dict(row.odds)
 
     def create_odds(self, row):
         """ Creates the odds related to the match. """
 
         match_params = self.get_match_params(row)
         match = Match.objects.get(**match_params)
-        odds_params = {'match': match}
-        prefixes = [
-            'b365',
-            'ex',
-            'lb',
-            'ps',
-            'sj',
-            'max',
-            'avg'
-        ]
-        suffix_pairs = (('w', '_winner'), ('l', '_loser'))
-        for prefix in prefixes:
-            for in_suffix, out_suffix in suffix_pairs:
-                cell_value = row[CELL_MAP[prefix + in_suffix]].value
-                cell_value = float_or_value(cell_value, DEFAULT_ODD)
-                odds_params[prefix + out_suffix] = cell_value
-        odds = Odds(**odds_params)
-        odds.save()
-
-    def iterate_rows(self, workbook):
-        """ An iterator over the rows of the important sheet. """
-
-        sheet = workbook.sheet_by_name(self.sheet_name)
-        for i in xrange(1, sheet.nrows):
-            print "yielding row %s" % i
-            yield sheet.row(i)
-
-    def create_xls_obj(self):
-        """ Downloads the zipfile and creates and return the xls workbook. """
-
-        response = urllib2.urlopen(self.file_url)
-        zipfile_name = tempfile.mkstemp()[1]
-        zipfile = open(zipfile_name, 'w')
-        zipfile.write(response.read())
-        zipfile.close()
-
-        zipfile = ZipFile(zipfile_name)
-        xlsfile_name = tempfile.mkstemp()[1]
-        xlsfile = open(xlsfile_name, 'w')
-        fromzip_file = zipfile.open(zipfile.infolist()[0])
-        xlsfile.write(fromzip_file.read())
-        xlsfile.close()
-        zipfile.close()
-
-        return open_workbook(xlsfile_name)
+        for name, (winner_odd, loser_odd) in self.get_odds_params(row).iteritems():
+            bookmaker = Bookmaker.objects.get_or_create(name=name)[0]
+            BookmakerOdds(match=match, bookmaker=bookmaker,
+                          winner_odd=winner_odd, loser_odd=loser_odd).save()
+        Odds(match=match).save()
+        Odds.objects.refresh([match.pk])
+
+    def create_stats(self, row):
+        """ Adds the match of the row to the statistics of its players. """
+
+        match_params = self.get_match_params(row)
+        deltas = stats.new_deltas()
+        stats.add_match(deltas, match_params['winner'].pk,
+                        match_params['loser'].pk, match_params['date'],
+                        match_params['tournament'].surface,
+                        self.get_set_scores(row))
+        stats.apply_deltas(deltas)
+
+    def copy_to_file(self, source, file_name):
+        """ Copies the file-like source to file_name chunk by chunk. """
+
+        with open(file_name, 'wb') as destination:
+            copyfileobj(source, destination, DOWNLOAD_CHUNK_SIZE)
+
+    def fetch_archive(self, temp_files):
+        """ Returns the local path of the datasource, downloading it if needed.
+
+        The file_url can also be a local archive. With a cache_dir the
+        archive is looked up and downloaded under the path of the url
+        inside the directory, so later imports can work offline.
+        """
+
+        if os.path.isfile(self.file_url):
+            return self.file_url
+        if self.cache_dir:
+            url_path = urlparse.urlparse(self.file_url).path.lstrip('/')
+            archive_name = os.path.join(self.cache_dir, url_path)
+            if os.path.isfile(archive_name):
+                return archive_name
+            archive_dir = os.path.dirname(archive_name)
+            if not os.path.isdir(archive_dir):
+                os.makedirs(archive_dir)
+        else:
+            archive_name = None
+            archive_dir = None
+        fd, download_name = tempfile.mkstemp(dir=archive_dir)
+        os.close(fd)
+        temp_files.append(download_name)
+        response = urllib2.urlopen(self.file_url, timeout=IMPORT_DOWNLOAD_TIMEOUT)
+        try:
+            self.copy_to_file(response, download_name)
+        finally:
+            response.close()
+        if archive_name is None:
+            return download_name
+        os.rename(download_name, archive_name)
+        temp_files.remove(download_name)
+        return archive_name
+
+    def extract_datasource(self, file_name, temp_files):
+        """ Extracts the first workbook or CSV member of the zip to a
+        temporary file and returns its path.
+
+        Returns the path of the zip if it has no such member.
+        """
+
+        with closing(ZipFile(file_name)) as archive:
+            for member in archive.infolist():
+                extension = os.path.splitext(member.filename)[1].lower()
+                if extension in DATASOURCE_EXTENSIONS:
+                    break
+            else:
+                return file_name
+            fd, member_name = tempfile.mkstemp(suffix=extension)
+            os.close(fd)
+            temp_files.append(member_name)
+            with closing(archive.open(member)) as fromzip_file:
+                self.copy_to_file(fromzip_file, member_name)
+        return member_name
+
+    def read_rows(self):
+        """ Fetches the datasource and returns its rows.
+
+        The datasource is an Excel workbook or a CSV file, possibly zipped.
+        The first workbook or CSV member of a zip is extracted to disk in
+        chunks, so the archive is never held in memory. A zip without such
+        a member is an xlsx workbook itself. The temporary files are removed
+        once the rows are read. The malformed rows are left out and
+        quarantined by the progress.
+        """
+
+        temp_files = []
+        try:
+            with self.progress.stage('download'):
+                file_name = self.fetch_archive(temp_files)
+            with self.progress.stage('unzip'):
+                extension = os.path.splitext(file_name)[1].lower()
+                if extension not in DATASOURCE_EXTENSIONS and is_zipfile(file_name):
+                    file_name = self.extract_datasource(file_name, temp_files)
+            with self.progress.stage('parse'):
+                table = read_table(file_name, self.sheet_name)
+        finally:
+            for temp_file in temp_files:
+                os.remove(temp_file)
+        self.progress.layout = table.layout
+        self.progress.rows = len(table.rows) + len(table.rejected)
+        self.progress.reject(table.rejected)
+        return table.rows
+
+
+class BulkPopulateDatabase(PopulateDatabase):
+    """ Populates the database with a fixed number of queries per batch.
+
+    The whole sheet is parsed first, the players and tournaments are resolved
+    through dictionaries keyed by their natural keys and every model is
+    inserted with batched bulk_create calls.
+
+    The import is incremental: every row is fingerprinted and recorded in the
+    ImportedRow ledger, so re-importing a file only inserts the new rows and
+    updates the changed ones.
+    """
+
+    batch_size = IMPORT_BATCH_SIZE
+
+    def __init__(self, file_url=None, sheet_name=None, cache_dir=None,
+                 autorun=True, job_id=None):
+        """ Populates the database from the datasource in bulk.
+
+        With autorun=False nothing is done, parse and populate can be
+        called separately (e.g. in different processes) and the caller
+        stores the progress. The progress is reported to the job if a job_id
+        is given.
+        """
+
+        self.file_url = file_url or self.file_url
+        self.sheet_name = sheet_name or self.sheet_name
+        self.cache_dir = cache_dir or self.cache_dir
+        self.progress = ImportProgress(self.file_url, job_id)
+        if autorun:
+            with self.progress.running():
+                self.populate(self.parse())
+
+    def parse(self):
+        """ Downloads the datasource and parses all of its rows. """
+
+        rows = self.read_rows()
+        with self.progress.stage('parse'):
+            return [self.parse_row(row) for row in rows]
+
+    def parse_row(self, row):
+        """ Converts a row to a plain record which doesn't touch the database. """
+
+        return {
+            'key': self.row_key(row),
+            'fingerprint': self.row_fingerprint(row),
+            'tournament': self.get_tournament_params(row),
+            'winner': row.winner,
+            'loser': row.loser,
+            'wrank': row.wrank,
+            'lrank': row.lrank,
+            'match': self.get_match_fields(row),
+            'sets': self.get_set_scores(row),
+            'odds': self.get_odds_params(row)
+        }
+
+    @staticmethod
+    def tournament_key(tournament_params):
+        """ The natural key of a tournament. """
+
+        return tuple(tournament_params[field] for field in TOURNAMENT_FIELDS)
+
+    @staticmethod
+    def match_key(tournament_id, winner_id, loser_id, match_fields):
+        """ The natural key of a match. """
+
+        return (tournament_id, winner_id, loser_id,
+                match_fields['round'], match_fields['date'])
+
+    def populate(self, records, progress=None):
+        """ Inserts the new and updates the changed records batch by batch.
+
+        The stages are timed by the progress, the one of this importer by
+        default.
+        """
+
+        progress = progress or self.progress
+        with progress.stage('select'):
+            pending = self.select_pending(records)
+        records = [record for match_id, record in pending]
+        with transaction.commit_on_success():
+            with progress.stage('tournaments'):
+                tournaments = self.resolve_tournaments(records)
+            with progress.stage('players'):
+                players = self.resolve_players(records)
+                bookmakers = self.resolve_bookmakers(records)
+            with progress.stage('rankings'):
+                self.create_bulk_rankings(records, tournaments, players)
+        done = 0
+        for batch in chunked(pending, self.batch_size):
+            with transaction.commit_on_success():
+                new = [record for match_id, record in batch if match_id is None]
+                changed = [(match_id, record) for match_id, record in batch
+                           if match_id is not None]
+                deltas = stats.new_deltas()
+                with progress.stage('stats'):
+                    stats.add_stored_matches(
+                        deltas, [match_id for match_id, record in changed], sign=-1)
+                with progress.stage('matches'):
+                    match_ids = self.create_bulk_matches(new, tournaments, players)
+                    self.update_matches(changed, tournaments, players)
+                batch_records = new + [record for match_id, record in changed]
+                batch_ids = match_ids + [match_id for match_id, record in changed]
+                with progress.stage('sets'):
+                    self.create_bulk_sets(batch_records, batch_ids)
+                with progress.stage('odds'):
+                    self.create_bulk_odds(batch_records, batch_ids, bookmakers)
+                with progress.stage('stats'):
+                    for record in batch_records:
+                        stats.add_match(deltas, players[record['winner']],
+                                        players[record['loser']],
+                                        record['match']['date'],
+                                        record['tournament']['surface'],
+                                        record['sets'])
+                    stats.apply_deltas(deltas)
+                with progress.stage('ledger'):
+                    self.record_imports(new, match_ids, changed)
+            done += len(batch)
+            progress.report(done, len(pending))
+        if pending:
+            bump_data_generation()
+
+    def select_pending(self, records):
+        """ Drops the records which were already imported unchanged.
+
+        Returns (match id, record) pairs where the match id is the match
+        updated by the record or None for the new records.
+        """
+
+        latest = OrderedDict((record['key'], record) for record in records)
+        ledger = {}
+        for keys_chunk in chunked(latest.keys(), self.batch_size):
+            imported = ImportedRow.objects.filter(key__in=keys_chunk) \
+                                          .values_list('key', 'fingerprint', 'match')
+            for key, fingerprint, match_id in imported:
+                ledger[key] = (fingerprint, match_id)
+        ledger.update(self.unrecorded_matches(
+            [record for key, record in latest.iteritems() if key not in ledger]))
+        pending = []
+        for key, record in latest.iteritems():
+            if key not in ledger:
+                pending.append((None, record))
+            elif ledger[key][0] != record['fingerprint']:
+                pending.append((ledger[key][1], record))
+        return pending
+
+    def unrecorded_matches(self, records):
+        """ Returns a key -> (None, match id) map of the stored matches of the
+        records which are missing from the ledger.
+
+        The matches imported before the ledger existed are found by their
+        natural key, so they are updated instead of inserted again.
+        """
+
+        keys = set(record['key'] for record in records)
+        dates = sorted(set(record['match']['date'] for record in records))
+        ret = {}
+        for dates_chunk in chunked(dates, self.batch_size):
+            # The first of the duplicated matches is updated
+            matches = Match.objects.filter(date__in=dates_chunk,
+                                           imported_row_of__isnull=True) \
+                                   .order_by('-id') \
+                                   .values_list('id', 'tournament__atp_number',
+                                                'tournament__name', 'date',
+                                                'winner__name', 'loser__name',
+                                                'round')
+            for values in matches:
+                key = self.match_row_key(*values[1:])
+                if key in keys:
+                    ret[key] = (None, values[0])
+        return ret
+
+    def update_matches(self, changed, tournaments, players):
+        """ Updates the changed matches and drops their sets and odds. """
+
+        if not changed:
+            return
+        for match_id, record in changed:
+            winner_id = players[record['winner']]
+            loser_id = players[record['loser']]
+            pair_low, pair_high = Match.pair(winner_id, loser_id)
+            Match.objects.filter(pk=match_id).update(
+                tournament=tournaments[self.tournament_key(record['tournament'])],
+                winner=winner_id,
+                loser=loser_id,
+                pair_low=pair_low,
+                pair_high=pair_high,
+                **record['match'])
+        match_ids = [match_id for match_id, record in changed]
+        Set.objects.filter(match__in=match_ids).delete()
+        Odds.objects.filter(match__in=match_ids).delete()
+        BookmakerOdds.objects.filter(match__in=match_ids).delete()
+
+    def record_imports(self, new, match_ids, changed):
+        """ Records the fingerprints of the imported records in the ledger. """
+
+        ImportedRow.objects.bulk_create([
+            ImportedRow(key=record['key'],
+                        fingerprint=record['fingerprint'],
+                        match_id=match_id)
+            for record, match_id in izip(new, match_ids)
+        ])
+        for match_id, record in changed:
+            updated = ImportedRow.objects.filter(key=record['key']) \
+                                         .update(fingerprint=record['fingerprint'])
+            if not updated:
+                ImportedRow(key=record['key'], fingerprint=record['fingerprint'],
+                            match_id=match_id).save()
+
+    def resolve_tournaments(self, records):
+        """ Returns a tournament key -> id map, creating the missing tournaments. """
+
+        wanted = {}
+        for record in records:
+            wanted[self.tournament_key(record['tournament'])] = record['tournament']
+        names = set(params['name'] for params in wanted.itervalues())
+
+        def existing():
+            ret = {}
+            for names_chunk in chunked(sorted(names), self.batch_size):
+                tournament_data = Tournament.objects.filter(name__in=names_chunk) \
+                                                    .values_list('id', *TOURNAMENT_FIELDS)
+                for values in tournament_data:
+                    ret[tuple(values[1:])] = values[0]
+            return ret
+
+        tournaments = existing()
+        missing = [Tournament(**params) for key, params in wanted.iteritems()
+                   if key not in tournaments]
+        if missing:
+            Tournament.objects.bulk_create(missing)
+            tournaments = existing()
+        return tournaments
+
+    def resolve_players(self, records):
+        """ Returns a name -> id map, creating the missing players. """
+
+        names = set()
+        for record in records:
+            names.add(record['winner'])
+            names.add(record['loser'])
+
+        def existing():
+            ret = {}
+            for names_chunk in chunked(sorted(names), self.batch_size):
+                ret.update(Player.objects.filter(name__in=names_chunk)
+                                         .values_list('name', 'id'))
+            return ret
+
+        players = existing()
+        missing = [Player(name=name) for name in names if name not in players]
+        if missing:
+            Player.objects.bulk_create(missing)
+            players = existing()
+        return players
+
+    def resolve_bookmakers(self, records):
+        """ Returns a name -> id map of the bookmakers, creating the missing ones. """
+
+        bookmakers = dict(Bookmaker.objects.values_list('name', 'id'))
+        names = set()
+        for record in records:
+            names.update(record['odds'])
+        missing = [Bookmaker(name=name) for name in names if name not in bookmakers]
+        if missing:
+            Bookmaker.objects.bulk_create(missing)
+            bookmakers = dict(Bookmaker.objects.values_list('name', 'id'))
+        return bookmakers
+
+    def create_bulk_rankings(self, records, tournaments, players):
+        """ Creates the rankings which don't exist yet for the (tournament, player) pairs. """
+
+        tournament_ids = sorted(set(tournaments.itervalues()))
+        known = set()
+        for ids_chunk in chunked(tournament_ids, self.batch_size):
+            known.update(Ranking.objects.filter(tournament__in=ids_chunk)
+                                        .values_list('tournament', 'player'))
+        rankings = []
+        for record in records:
+            tournament_id = tournaments[self.tournament_key(record['tournament'])]
+            for player_type, rank_name in (("winner", "wrank"), ("loser", "lrank")):
+                key = (tournament_id, players[record[player_type]])
+                if key not in known:
+                    known.add(key)
+                    rankings.append(Ranking(tournament_id=key[0],
+                                            player_id=key[1],
+                                            rank=record[rank_name]))
+        Ranking.objects.bulk_create(rankings)
+
+    def create_bulk_matches(self, batch, tournaments, players):
+        """ Inserts the matches of the batch and returns their ids in batch order. """
+
+        if not batch:
+            return []
+        last_id = Match.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        keys = []
+        matches = []
+        for record in batch:
+            tournament_id = tournaments[self.tournament_key(record['tournament'])]
+            winner_id = players[record['winner']]
+            loser_id = players[record['loser']]
+            keys.append(self.match_key(tournament_id, winner_id, loser_id,
+                                       record['match']))
+            pair_low, pair_high = Match.pair(winner_id, loser_id)
+            matches.append(Match(tournament_id=tournament_id,
+                                 winner_id=winner_id,
+                                 loser_id=loser_id,
+                                 pair_low_id=pair_low,
+                                 pair_high_id=pair_high,
+                                 **record['match']))
+        Match.objects.bulk_create(matches)
+        created = Match.objects.filter(pk__gt=last_id).values_list(
+            'id', 'tournament', 'winner', 'loser', 'round', 'date')
+        ids = dict((tuple(values[1:]), values[0]) for values in created)
+        return [ids[key] for key in keys]
+
+    def create_bulk_sets(self, batch, match_ids):
+        """ Inserts the sets of the batch. """
+
+        sets = []
+        for record, match_id in izip(batch, match_ids):
+            for i, (winner_games, loser_games) in enumerate(record['sets']):
+                sets.append(Set(match_id=match_id,
+                                set_number=i + 1,
+                                winner_games=winner_games,
+                                loser_games=loser_games))
+        Set.objects.bulk_create(sets)
+
+    def create_bulk_odds(self, batch, match_ids, bookmakers):
+        """ Inserts the odds of the batch and computes their aggregates. """
 
+        bookmaker_odds = []
+        for record, match_id in izip(batch, match_ids):
+            for name, (winner_odd, loser_odd) in record['odds'].iteritems():
+                bookmaker_odds.append(BookmakerOdds(match_id=match_id,
+                                                    bookmaker_id=bookmakers[name],
+                                                    winner_odd=winner_odd,
+                                                    loser_odd=loser_odd))
+        BookmakerOdds.objects.bulk_create(bookmaker_odds)
+        Odds.objects.bulk_create([Odds(match_id=match_id) for match_id in match_ids])
+        Odds.objects.refresh(match_ids)
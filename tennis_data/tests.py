@@ -0,0 +1,322 @@
+import os
+import csv
+import shutil
+import datetime
+import tempfile
+from contextlib import closing
+from json import loads
+from zipfile import ZipFile
+from xml.sax.saxutils import escape
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from tennis_data.models import (Tournament, Player, Match, Set, ImportedRow,
+                                BookmakerOdds, DataGeneration)
+from tennis_data.cache import bump_data_generation, GENERATION_ID
+from tennis_data.benchmark import season_fixture
+from tennis_data.tasks import PopulateDatabase, BulkPopulateDatabase
+from tennis_data.management.commands.upgrade_schema import INDEX_NAME
+
+
+def create_matches(count):
+    """ Creates count matches of the first player against the others with
+    two sets each, the first player winning every second one.
+    """
+
+    tournament = Tournament.objects.create(atp_number=1, name='Open',
+                                           location='City', series='ATP250',
+                                           court='Outdoor', surface='Hard',
+                                           best_of=3)
+    first = Player.objects.create(name='Player 0.')
+    for i in xrange(1, count + 1):
+        other = Player.objects.create(name='Player %s.' % i)
+        winner, loser = (first, other) if i % 2 else (other, first)
+        match = Match.objects.create(winner=winner, loser=loser,
+                                     tournament=tournament,
+                                     date=datetime.date(2011, 1, 1) +
+                                     datetime.timedelta(days=i),
+                                     round='1st Round', winner_points=100,
+                                     loser_points=50, status='Completed')
+        for set_number in (1, 2):
+            Set.objects.create(match=match, set_number=set_number,
+                               winner_games=6, loser_games=set_number)
+    return first
+
+
+class APITestCase(TestCase):
+    def get_json(self, path):
+        """ Requests a path of the API, bypassing the cached responses. """
+
+        bump_data_generation()
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return loads(response.content)
+
+
+class PlayerMatchesTest(APITestCase):
+    def test_queries(self):
+        player = create_matches(10)
+        path = '/api/player/%s/matches/' % player.pk
+        bump_data_generation()
+        # The player, the matches with their tournaments and the sets
+        with self.assertNumQueries(3):
+            response = self.client.get(path)
+        data = loads(response.content)['data']
+        self.assertEqual(len(data['won']), 5)
+        self.assertEqual(len(data['lost']), 5)
+        self.assertEqual(data['won'][0]['sets'], [[6, 1], [6, 2]])
+
+    def test_missing_player(self):
+        data = self.get_json('/api/player/1/matches/')
+        self.assertEqual(data['status'], 'error')
+
+
+def index_name(model, field_name):
+    """ The name of the index of a field of a model. """
+
+    field = model._meta.get_field(field_name)
+    sql = connection.creation.sql_indexes_for_field(model, field, no_style())[0]
+    return INDEX_NAME.match(sql).group(1)
+
+
+def query_plan(queryset):
+    """ The plan of the query of the queryset as text.
+
+    The sequential scans are disabled on PostgreSQL, the tables of the
+    tests are too small for the planner to prefer an index otherwise. The
+    sqlite3 module commits before an EXPLAIN, so it can't be run in a
+    TestCase.
+    """
+
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    elif connection.vendor == 'postgresql':
+        cursor.execute('SET LOCAL enable_seqscan TO off')
+        cursor.execute('EXPLAIN ' + sql, params)
+    else:
+        return None
+    return '\n'.join(unicode(row[-1]) for row in cursor.fetchall())
+
+
+class SearchMatchesTest(APITestCase):
+    def setUp(self):
+        self.player = create_matches(12)
+
+    def search(self, query):
+        return self.get_json('/api/matches/search/?' + query)
+
+    def test_invalid_parameters(self):
+        for query in ('from=2011-13-01', 'to=yesterday', 'round=',
+                      'surface=', 'tournament=x', 'player=-1', 'limit=0',
+                      'after=x', 'fields=id,unknown'):
+            data = self.search(query)
+            self.assertEqual(data['status'], 'error', query)
+
+    def test_filters(self):
+        data = self.search('from=2011-01-03&to=2011-01-06&surface=Hard')
+        self.assertEqual([match['date'] for match in data['data']],
+                         ['2011-01-03', '2011-01-04', '2011-01-05',
+                          '2011-01-06'])
+        self.assertEqual(self.search('surface=Clay')['data'], [])
+        data = self.search('player=%s&round=1st+Round' % self.player.pk)
+        self.assertEqual(len(data['data']), 12)
+
+    def test_keyset_pagination(self):
+        ids = []
+        query = 'player=%s&limit=5&fields=id' % self.player.pk
+        data = self.search(query)
+        while True:
+            ids.extend(match['id'] for match in data['data'])
+            if data['next'] is None:
+                break
+            self.assertEqual(data['next'], ids[-1])
+            data = self.search('%s&after=%s' % (query, data['next']))
+        self.assertEqual(ids, sorted(Match.objects.values_list('id', flat=True)))
+
+
+class SearchIndexTest(TransactionTestCase):
+    def setUp(self):
+        create_matches(12)
+
+    def assertUsesIndex(self, queryset, model, field_name):
+        plan = query_plan(queryset.order_by('id').values('id')[:10])
+        if plan is None:
+            self.skipTest("EXPLAIN isn't supported on %s" % connection.vendor)
+        self.assertIn(index_name(model, field_name), plan)
+
+    def test_indexes(self):
+        self.assertUsesIndex(Match.objects.filter(
+            date__gte=datetime.date(2011, 1, 3),
+            date__lte=datetime.date(2011, 1, 6)), Match, 'date')
+        self.assertUsesIndex(Match.objects.filter(round='Quarterfinals'),
+                             Match, 'round')
+        self.assertUsesIndex(Match.objects.filter(tournament__surface='Clay'),
+                             Tournament, 'surface')
+        self.assertUsesIndex(Match.objects.filter(tournament__series='ATP500'),
+                             Tournament, 'series')
+
+
+# The parts of an xlsx workbook with one sheet, but the sheet itself
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types"><Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/><Default Extension='
+        '"xml" ContentType="application/xml"/><Override PartName="/xl/'
+        'workbook.xml" ContentType="application/vnd.openxmlformats-'
+        'officedocument.spreadsheetml.sheet.main+xml"/><Override PartName='
+        '"/xl/worksheets/sheet1.xml" ContentType="application/vnd.'
+        'openxmlformats-officedocument.spreadsheetml.worksheet+xml"/></Types>',
+    '_rels/.rels':
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        'openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml':
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+        'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships"><sheets><sheet name="%(sheet_name)s" sheetId="1" '
+        'r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        'openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>',
+}
+
+
+def write_xlsx(file_name, sheet_name, rows):
+    """ Writes the rows to a minimal xlsx workbook with one sheet. """
+
+    cells = ''.join('<row>%s</row>' % ''.join(
+        '<c t="inlineStr"><is><t>%s</t></is></c>' % escape(value)
+        if isinstance(value, basestring) else '<c><v>%r</v></c>' % value
+        for value in row) for row in rows)
+    with closing(ZipFile(file_name, 'w')) as workbook:
+        for name, part in sorted(XLSX_PARTS.iteritems()):
+            workbook.writestr(name, part % {'sheet_name': sheet_name})
+        workbook.writestr('xl/worksheets/sheet1.xml',
+                          '<worksheet xmlns="http://schemas.openxmlformats.org/'
+                          'spreadsheetml/2006/main"><sheetData>%s</sheetData>'
+                          '</worksheet>' % cells)
+
+
+# A datasource with one match
+SINGLE_MATCH = [
+    ['ATP', 'Tournament', 'Date', 'Surface', 'Round', 'Winner', 'Loser'],
+    [1, 'Open', '03/01/2011', 'Hard', '1st Round', 'Player 1.', 'Player 2.'],
+]
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        self.fixtures_dir = tempfile.mkdtemp()
+        self.file_name = season_fixture(self.fixtures_dir, 0.02, 2011)
+
+    def tearDown(self):
+        shutil.rmtree(self.fixtures_dir)
+
+    def write_csv(self, name, rows):
+        """ Writes the rows to a CSV file of the fixtures and returns its path. """
+
+        file_name = os.path.join(self.fixtures_dir, name)
+        with open(file_name, 'wb') as csv_file:
+            csv.writer(csv_file).writerows(rows)
+        return file_name
+
+    def test_bulk_after_legacy(self):
+        PopulateDatabase(self.file_name, '2011')
+        count = Match.objects.count()
+        self.assertTrue(count)
+        self.assertEqual(ImportedRow.objects.count(), count)
+        BulkPopulateDatabase(self.file_name, '2011')
+        self.assertEqual(Match.objects.count(), count)
+
+    def test_legacy_twice(self):
+        PopulateDatabase(self.file_name, '2011')
+        count = Match.objects.count()
+        importer = PopulateDatabase(self.file_name, '2011')
+        self.assertEqual(importer.progress.imported, 0)
+        self.assertEqual(Match.objects.count(), count)
+
+    def test_legacy_repeated_row(self):
+        file_name = self.write_csv('repeated.csv',
+                                   SINGLE_MATCH + SINGLE_MATCH[1:])
+        PopulateDatabase(file_name, '2011')
+        self.assertEqual(Match.objects.count(), 1)
+
+    def test_bulk_without_ledger(self):
+        PopulateDatabase(self.file_name, '2011')
+        count = Match.objects.count()
+        # The matches imported before the ledger existed
+        ImportedRow.objects.all().delete()
+        BulkPopulateDatabase(self.file_name, '2011')
+        self.assertEqual(Match.objects.count(), count)
+        self.assertEqual(ImportedRow.objects.count(), count)
+        self.assertEqual(Set.objects.filter(match__imported_row_of=None).count(), 0)
+
+    def test_unknown_bookmakers(self):
+        file_name = self.write_csv('bookmakers.csv', [
+            ['ATP', 'Tournament', 'Date', 'Surface', 'Round', 'Winner', 'Loser',
+             'B365W', 'B365L', 'CBW', 'CBL', 'MaxW', 'MaxL'],
+            [1, 'Open', '03/01/2011', 'Hard', '1st Round', 'Player 1.',
+             'Player 2.', 1.5, 2.5, 1.4, '', 1.6, 2.9],
+            [1, 'Open', '04/01/2011', 'Hard', '2nd Round', 'Player 1.',
+             'Player 3.', 1.2, 4.0, 1.3, 3.5, 1.3, 4.5],
+        ])
+        BulkPopulateDatabase(file_name, '2011')
+        odds = BookmakerOdds.objects.order_by('match__date', 'bookmaker__name') \
+                                    .values_list('match__round', 'bookmaker__name',
+                                                 'winner_odd', 'loser_odd')
+        self.assertEqual(list(odds), [('1st Round', 'b365', 1.5, 2.5),
+                                      ('2nd Round', 'b365', 1.2, 4.0),
+                                      ('2nd Round', 'cb', 1.3, 3.5)])
+
+    def test_xlsx(self):
+        file_name = os.path.join(self.fixtures_dir, 'season.xlsx')
+        write_xlsx(file_name, '2011', SINGLE_MATCH)
+        BulkPopulateDatabase(file_name, '2011')
+        self.assertEqual(Match.objects.count(), 1)
+        # A downloaded workbook has no extension
+        shutil.copy(file_name, os.path.join(self.fixtures_dir, 'download'))
+        Match.objects.all().delete()
+        ImportedRow.objects.all().delete()
+        BulkPopulateDatabase(os.path.join(self.fixtures_dir, 'download'), '2011')
+        self.assertEqual(Match.objects.count(), 1)
+
+    def test_zipped_csv(self):
+        csv_name = self.write_csv('season.csv', SINGLE_MATCH)
+        file_name = os.path.join(self.fixtures_dir, 'season.zip')
+        with closing(ZipFile(file_name, 'w')) as archive:
+            archive.writestr('readme.txt', 'The 2011 season')
+            archive.write(csv_name, '2011.csv')
+        BulkPopulateDatabase(file_name, '2011')
+        self.assertEqual(Match.objects.count(), 1)
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.player = create_matches(2)
+        bump_data_generation()
+
+    def assertBumps(self, method, path, data=None):
+        generation = DataGeneration.objects.get(pk=GENERATION_ID).generation
+        response = method(path, data or {})
+        self.assertEqual(response.status_code, 302)
+        self.assertGreater(DataGeneration.objects.get(pk=GENERATION_ID).generation,
+                           generation)
+
+    def test_changes(self):
+        self.assertBumps(self.client.post, '/admin/tennis_data/set/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': list(Set.objects.values_list('pk', flat=True))})
+        self.assertFalse(Set.objects.exists())
+        path = '/admin/tennis_data/player/%s/' % self.player.pk
+        self.assertBumps(self.client.post, path, {'name': 'Player 00.'})
+        self.assertBumps(self.client.post, path + 'delete/', {'post': 'yes'})
+        self.assertFalse(Player.objects.filter(pk=self.player.pk).exists())
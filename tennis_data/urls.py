@@ -5,12 +5,25 @@ admin.autodiscover()
 
 urlpatterns = patterns('',
     url(r'^warmup/$', 'tennis_data.views.warmup'),
+    url(r'^api/_metrics$', 'tennis_data.views.metrics'),
     url(r'^api/players/$', 'tennis_data.api.players'),
     url(r'^api/player/(?P<player_id>\d+)/matches/$', 'tennis_data.api.player_matches'),
+    url(r'^api/player/(?P<player_id>\d+)/stats/$', 'tennis_data.api.player_stats'),
+    url(r'^api/player/(?P<player_id>\d+)/rating/$', 'tennis_data.api.player_rating'),
+    url(r'^api/ratings/$', 'tennis_data.api.ratings'),
+    url(r'^api/h2h/(?P<player_a>\d+)/(?P<player_b>\d+)/$', 'tennis_data.api.head_to_head'),
     url(r'^api/tournaments/$', 'tennis_data.api.tournaments'),
     url(r'^api/tournament/(?P<tournament_id>\d+)/players/$', 'tennis_data.api.tournament_players'),
     url(r'^api/matches/$', 'tennis_data.api.matches'),
+    url(r'^api/matches/search/$', 'tennis_data.api.search_matches'),
+    url(r'^api/matches/details/$', 'tennis_data.api.match_details'),
     url(r'^api/match/(?P<match_id>\d+)/odds/$', 'tennis_data.api.match_odds'),
+    url(r'^api/odds/$', 'tennis_data.api.batch_odds'),
+    url(r'^api/odds/analysis/$', 'tennis_data.api.odds_analysis'),
+    url(r'^api/imports/$', 'tennis_data.api.imports'),
+    url(r'^api/jobs/(?P<job_id>\d+)/$', 'tennis_data.api.job'),
+    url(r'^api/export/matches\.ndjson$', 'tennis_data.api.export_matches'),
+    url(r'^api/export/matches\.npz$', 'tennis_data.api.export_matches_npz'),
     # Examples:
     # url(r'^$', 'tennis_data.views.home', name='home'),
     # url(r'^tennis_data/', include('tennis_data.foo.urls')),
@@ -0,0 +1,5 @@
+def chunked(sequence, size):
+    """ Splits the sequence into lists of at most size elements. """
+
+    for start in xrange(0, len(sequence), size):
+        yield sequence[start:start + size]
@@ -1,7 +1,24 @@
+from json import dumps
 from django.http import HttpResponse
-from tennis_data.tasks import PopulateDatabase
+from tennis_data.jobs import enqueue_once
+from tennis_data.middleware import prometheus_text
 
 
 def warmup(request):
-    PopulateDatabase()
-    return HttpResponse("db populated")
+    """ Queues an import for the workers and returns the id of its job.
+
+    If the import is already queued or running its job is returned instead.
+    The progress of the job is reported at /api/jobs/<id>/.
+    """
+
+    job = enqueue_once('import')
+    return HttpResponse(dumps({'job': job.pk,
+                               'url': '/api/jobs/%s/' % job.pk}),
+                        content_type='application/json', status=202)
+
+
+def metrics(request):
+    """ The metrics of the API views in the Prometheus text format. """
+
+    return HttpResponse(prometheus_text(),
+                        content_type='text/plain; version=0.0.4')